@@ -0,0 +1,219 @@
+"""
+Synthetic PROV workloads and end-to-end benchmarks
+
+Generates nipype-shaped workflows of a given size and times the provpy
+serializations, bundle comparison, DOT conversion and the ingest of the
+workflow into an in-memory graph. Results are written as JSON so that runs
+can be compared across releases.
+
+Example:
+
+    python -m provbulbs.benchmark --nodes 10000 --fan-out 3 --depth 1 --output results.json
+"""
+__author__ = 'nolan'
+
+import argparse
+import datetime
+import json
+import platform
+import StringIO
+import sys
+import time
+import timeit
+
+from interface import Interface
+from memory import MemoryGraph, Store
+import prov
+
+NIPYPE = prov.Namespace('nipype', 'http://nipy.org/nipype/terms/0.6/')
+FOAF = prov.Namespace('foaf', 'http://xmlns.com/foaf/0.1/')
+DCTERMS = prov.Namespace('dcterms', 'http://purl.org/dc/terms/')
+
+BENCHMARKS = ('decode', 'load_stream', 'encode', 'provn', 'eq', 'dot', 'process_bundle', 'process_bundle_batched')
+
+
+def generate_workflow(nodes=100, fan_out=2, depth=0, attributes=3):
+    """
+    build a bundle shaped like the provenance of a nipype workflow
+
+    The workflow is a tree of nodes, each node an activity that uses a
+    parameter entity and the output of its parent node and generates an
+    output file, fanning out to fan_out child nodes. With depth > 0 the nodes
+    are split between the top level bundle and a chain of depth nested
+    bundles, one sub-workflow per level. attributes is the number of extra
+    nipype:param_<n> attributes on every activity and entity.
+    """
+    bundle = prov.ProvBundle()
+    for namespace in (NIPYPE, FOAF, DCTERMS):
+        bundle.add_namespace(namespace)
+    bundle.set_default_namespace(NIPYPE.get_uri())
+
+    levels = depth + 1
+    container = bundle
+    for level in range(levels):
+        count = nodes // levels + (1 if level < nodes % levels else 0)
+        _add_workflow(container, 'wf%d' % level, count, fan_out, attributes)
+        if level < depth:
+            container = container.bundle(NIPYPE['wf%d.bundle' % (level + 1)])
+    return bundle
+
+
+def _add_workflow(bundle, name, nodes, fan_out, attributes):
+    # relations must stay within their bundle, so every level has its own agents
+    user = bundle.agent(NIPYPE['%s.user' % name], {
+        prov.PROV['type']: prov.PROV['Person'], FOAF['name']: 'nolan', prov.PROV['label']: 'nolan'})
+    software = bundle.agent(NIPYPE['%s.nipype' % name], {
+        prov.PROV['type']: prov.PROV['SoftwareAgent'], prov.PROV['label']: 'nipype 0.6'})
+    bundle.actedOnBehalfOf(software, user)
+
+    start = datetime.datetime(2012, 8, 22, 3, 23, 12)
+    activities, outputs = [], []
+    for i in range(nodes):
+        node = '%s.node_%d' % (name, i)
+        params = dict((NIPYPE['param_%d' % n], 'value %d of %s' % (n, node)) for n in range(attributes))
+
+        activity_attributes = {
+            prov.PROV['type']: NIPYPE['%s.interface_%d' % (name, i % 7)],
+            prov.PROV['label']: node,
+            NIPYPE['cmdline']: 'bet /data/%s/in.nii /data/%s/out.nii.gz' % (node, node),
+            FOAF['host']: 'node%d.cluster.local' % (i % 16),
+        }
+        activity_attributes.update(params)
+        begin = start + datetime.timedelta(seconds=i)
+        activity = bundle.activity(NIPYPE[node], begin, begin + datetime.timedelta(seconds=15), activity_attributes)
+
+        parameter_attributes = {
+            prov.PROV['type']: NIPYPE['input'], prov.PROV['value']: 'NIFTI_GZ', prov.PROV['label']: 'output_type'}
+        parameter_attributes.update(params)
+        parameter = bundle.entity(NIPYPE['%s_output_type' % node], parameter_attributes)
+
+        output_attributes = {
+            prov.PROV['type']: NIPYPE['output'], prov.PROV['value']: '/data/%s/out.nii.gz' % node,
+            prov.PROV['label']: 'out_file'}
+        output_attributes.update(params)
+        output = bundle.entity(NIPYPE['%s_out_file' % node], output_attributes)
+
+        bundle.used(activity, parameter)
+        bundle.wasGeneratedBy(output, activity)
+        bundle.wasAssociatedWith(activity, software)
+        if i:
+            parent = (i - 1) // fan_out if fan_out else i - 1
+            bundle.used(activity, outputs[parent])
+            bundle.wasDerivedFrom(output, outputs[parent])
+            if not fan_out or (i - 1) % fan_out == 0:
+                bundle.wasStartedBy(activity, starter=activities[parent])
+        activities.append(activity)
+        outputs.append(output)
+
+
+def count_records(bundle):
+    count = 0
+    for record in bundle.get_records():
+        count += 1
+        if isinstance(record, prov.ProvBundle):
+            count += count_records(record)
+    return count
+
+
+def time_call(func, repeat=3):
+    """
+    run func repeat times, returns the timings in seconds
+    """
+    timings = []
+    for i in range(repeat):
+        start = timeit.default_timer()
+        func()
+        timings.append(timeit.default_timer() - start)
+    return {'best': min(timings), 'mean': sum(timings) / len(timings), 'runs': timings}
+
+
+def _prov_to_dot():
+    """
+    provgraph.prov_to_dot, or None when pydot is not installed
+    """
+    try:
+        import pydot
+    except ImportError:
+        return None
+    try:
+        from provgraph import prov_to_dot
+    except ValueError:
+        # provgraph uses package relative imports
+        from provbulbs.provgraph import prov_to_dot
+    return prov_to_dot
+
+
+def run(nodes=100, fan_out=2, depth=0, attributes=3, repeat=3, latency=0.0, batch_size=500,
+        benchmarks=BENCHMARKS):
+    """
+    generate a workflow and time the selected benchmarks on it, returns the results as a dictionary
+    """
+    start = timeit.default_timer()
+    bundle = generate_workflow(nodes, fan_out, depth, attributes)
+    generated = timeit.default_timer() - start
+    text = json.dumps(bundle, cls=prov.ProvBundle.JSONEncoder)
+    # two equal bundles, so that the comparison does not stop at the first record
+    decoded = json.loads(text, cls=prov.ProvBundle.JSONDecoder)
+    other = json.loads(text, cls=prov.ProvBundle.JSONDecoder)
+
+    def ingest(**options):
+        interface = Interface(Store(latency), graph_class=MemoryGraph)
+        interface.process_bundle(bundle, **options)
+
+    calls = {
+        'decode': lambda: json.loads(text, cls=prov.ProvBundle.JSONDecoder),
+        'load_stream': lambda: prov.ProvBundle.load_stream(StringIO.StringIO(text)),
+        'encode': bundle._encode_JSON_container,
+        'provn': bundle.get_provn,
+        'eq': lambda: decoded == other,
+        'process_bundle': ingest,
+        'process_bundle_batched': lambda: ingest(batch_size=batch_size),
+    }
+    prov_to_dot = _prov_to_dot()
+    if prov_to_dot is not None:
+        calls['dot'] = lambda: prov_to_dot(bundle)
+
+    results = {}
+    for name in benchmarks:
+        if name not in calls:
+            results[name] = {'skipped': 'pydot is not installed'}
+        else:
+            results[name] = time_call(calls[name], repeat)
+
+    return {
+        'workload': {'nodes': nodes, 'fan_out': fan_out, 'depth': depth, 'attributes': attributes,
+                     'records': count_records(bundle), 'json_bytes': len(text),
+                     'generate_seconds': generated},
+        'settings': {'repeat': repeat, 'latency': latency, 'batch_size': batch_size},
+        'environment': {'python': platform.python_version(), 'platform': platform.platform(),
+                        'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())},
+        'results': results,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark provpy and the provbulbs interface on synthetic workflows.')
+    parser.add_argument('--nodes', type=int, default=100, help='workflow nodes (default: %(default)s)')
+    parser.add_argument('--fan-out', type=int, default=2, help='child nodes per node (default: %(default)s)')
+    parser.add_argument('--depth', type=int, default=0, help='nested bundles (default: %(default)s)')
+    parser.add_argument('--attributes', type=int, default=3, help='extra attributes per element (default: %(default)s)')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per benchmark (default: %(default)s)')
+    parser.add_argument('--latency', type=float, default=0.0, help='simulated graph round trip in seconds (default: %(default)s)')
+    parser.add_argument('--batch-size', type=int, default=500, help='records per batch for process_bundle_batched (default: %(default)s)')
+    parser.add_argument('--only', nargs='+', choices=BENCHMARKS, default=BENCHMARKS, help='benchmarks to run (default: all)')
+    parser.add_argument('--output', help='write the results to this file instead of stdout')
+    args = parser.parse_args(argv)
+
+    results = run(args.nodes, args.fan_out, args.depth, args.attributes, args.repeat, args.latency,
+                  args.batch_size, args.only)
+    output = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print output
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,488 @@
+"""
+Columnar storage for very large PROV bundles
+
+A ColumnarBundle keeps its records as columns of arrays instead of one
+ProvRecord object per record: a record type code and an interned identifier
+per row, one column per PROV attribute in use (identifier ids for the
+records it refers to, seconds since the epoch for times) and a side table
+for the extra attributes. Scans, filters and lineage traversals run over the
+arrays; RecordView objects give access to single rows, and ProvRecord
+objects are only created by to_bundle() or RecordView.to_record().
+
+Example:
+
+>>> store = ColumnarBundle.from_bundle(bundle)
+>>> for view in store.find(prov.PROV_ATTR_ENTITY, 'nipype:out_file', prov.PROV_REC_GENERATION):
+...     print view.get_attribute(prov.PROV_ATTR_ACTIVITY)
+>>> [str(view.get_identifier()) for view in store.ancestors('nipype:out_file', max_depth=2)]
+>>> bundle = store.to_bundle()
+"""
+__author__ = 'nolan'
+
+import array
+import collections
+import datetime
+
+import prov
+
+_EPOCH = datetime.datetime(1970, 1, 1)
+_NO_TIME = float('nan')
+
+# PROV attributes holding a time, the others refer to records or identifiers
+TIME_ATTRIBUTES = tuple(prov.PROV_ATTRIBUTE_LITERALS)
+
+
+def _encode_time(value):
+    if value is None:
+        return _NO_TIME
+    delta = value - _EPOCH
+    return delta.days * 86400.0 + delta.seconds + delta.microseconds / 1e6
+
+
+def _decode_time(value):
+    if value != value:
+        # NaN, no time
+        return None
+    return _EPOCH + datetime.timedelta(microseconds=round(value * 1e6))
+
+
+class ColumnarBundle(object):
+    """
+    Append-only, array-backed store of the records of a bundle
+
+    Records are added with add_record() or copied from a ProvBundle with
+    from_bundle(); they cannot be modified afterwards. Rows are numbered in
+    the order records are added. A reference to a record without identifier
+    is kept as the row of that record. Sub-bundles are stored as nested
+    ColumnarBundle objects sharing the namespaces, see get_bundle().
+    """
+    def __init__(self, namespaces=None):
+        if namespaces is None:
+            namespaces = prov.NamespaceManager({prov.PROV.get_prefix(): prov.PROV, prov.XSD.get_prefix(): prov.XSD})
+        self._namespaces = namespaces
+        # interned identifiers and attribute names: term id -> Identifier, and
+        # the row of the record identified by a term, or -1
+        self._terms = []
+        self._term_ids = {}
+        self._term_rows = array.array('i')
+        # one entry per row
+        self._types = array.array('B')
+        self._identifiers = array.array('i')
+        # PROV attribute -> column, created when first used: term ids of the
+        # records or identifiers referred to, -(row + 2) for a record without
+        # identifier and -1 for none, or times for TIME_ATTRIBUTES
+        self._endpoints = {}
+        self._times = {}
+        # extra attributes of row r: keys/values[offsets[r]:offsets[r + 1]]
+        self._extra_offsets = array.array('l', [0])
+        self._extra_keys = array.array('i')
+        self._extra_values = []
+        # term id of a sub-bundle -> ColumnarBundle
+        self._bundles = {}
+        # lineage adjacency, built when first needed, see _get_lineage
+        self._lineage = None
+
+    def __len__(self):
+        return len(self._types)
+
+    # Identifiers
+    def _term(self, identifier):
+        term = self._term_ids.get(identifier)
+        if term is None:
+            term = self._term_ids[identifier] = len(self._terms)
+            self._terms.append(identifier)
+            self._term_rows.append(-1)
+        return term
+
+    def _find_term(self, identifier):
+        if isinstance(identifier, prov.ProvRecord):
+            identifier = identifier.get_identifier()
+        elif not isinstance(identifier, prov.Identifier):
+            identifier = self._namespaces.get_valid_identifier(identifier)
+        return self._term_ids.get(identifier, -1)
+
+    def get_row(self, identifier):
+        """
+        row of the record with the given identifier, or -1
+        """
+        term = self._find_term(identifier)
+        return self._term_rows[term] if term >= 0 else -1
+
+    def get_bundle(self, identifier):
+        """
+        the ColumnarBundle of a sub-bundle, or None
+        """
+        return self._bundles.get(self._find_term(identifier))
+
+    # Adding records
+    def _encode_endpoint(self, value):
+        if value is None:
+            return -1
+        if isinstance(value, (int, long)):
+            # the row of a record without identifier
+            return -(value + 2)
+        if isinstance(value, prov.ProvRecord):
+            value = value.get_identifier()
+        else:
+            value = self._namespaces.get_valid_identifier(value)
+        return self._term(value)
+
+    def add_record(self, record_type, identifier=None, attributes=None, extra_attributes=None):
+        """
+        append a record, returns its row
+
+        attributes maps PROV attribute ids to records, identifiers, rows of
+        records without identifier (as int) or, for TIME_ATTRIBUTES, datetimes.
+        The attributes are stored as given, without the validation done by
+        ProvBundle.add_record.
+        """
+        row = len(self._types)
+        term = -1
+        if identifier:
+            term = self._term(self._namespaces.get_valid_identifier(identifier))
+            self._term_rows[term] = row
+        self._types.append(record_type)
+        self._identifiers.append(term)
+
+        values = dict(attributes) if attributes else {}
+        for attr, column in self._endpoints.iteritems():
+            column.append(self._encode_endpoint(values.pop(attr, None)))
+        for attr, column in self._times.iteritems():
+            column.append(_encode_time(values.pop(attr, None)))
+        for attr, value in values.iteritems():
+            if value is None:
+                continue
+            if attr in prov.PROV_ATTRIBUTE_LITERALS:
+                column = self._times[attr] = array.array('d', [_NO_TIME]) * row
+                column.append(_encode_time(value))
+            else:
+                column = self._endpoints[attr] = array.array('i', [-1]) * row
+                column.append(self._encode_endpoint(value))
+
+        if extra_attributes:
+            try:
+                extra_attributes = extra_attributes.items()
+            except AttributeError:
+                pass
+            get_identifier = self._namespaces.get_attribute_identifier
+            for attr, value in extra_attributes:
+                self._extra_keys.append(self._term(get_identifier(attr)))
+                self._extra_values.append(value)
+        self._extra_offsets.append(len(self._extra_keys))
+        self._lineage = None
+        return row
+
+    @classmethod
+    def from_bundle(cls, bundle, namespaces=None):
+        """
+        copy the records of a ProvBundle, elements first
+        """
+        if namespaces is None:
+            namespaces = prov.NamespaceManager({prov.PROV.get_prefix(): prov.PROV, prov.XSD.get_prefix(): prov.XSD})
+            default = bundle.get_default_namespace()
+            if default is not None:
+                namespaces.set_default_namespace(default.get_uri())
+            for namespace in bundle.get_registered_namespaces():
+                namespaces.add_namespace(namespace)
+        store = cls(namespaces)
+        records = bundle.get_elements() + bundle.get_relations()
+        # rows of the records without identifier, which are referred to by row
+        rows = dict((id(record), row) for row, record in enumerate(records) if record.get_identifier() is None)
+        for record in records:
+            attributes, extra_attributes = record.get_attributes()
+            if attributes:
+                attributes = dict((attr, rows[id(value)] if isinstance(value, prov.ProvRecord) and id(value) in rows else value)
+                                  for attr, value in attributes.items())
+            row = store.add_record(record.get_type(), record.get_identifier(), attributes, extra_attributes)
+            if isinstance(record, prov.ProvBundle):
+                store._bundles[store._identifiers[row]] = cls.from_bundle(record, namespaces)
+        return store
+
+    # Rows
+    def get_type(self, row):
+        return self._types[row]
+
+    def get_identifier(self, row):
+        term = self._identifiers[row]
+        return self._terms[term] if term >= 0 else None
+
+    def get_attribute(self, row, attr):
+        """
+        value of a PROV attribute: an Identifier, a RecordView for a record without identifier, a datetime or None
+        """
+        column = self._times.get(attr)
+        if column is not None:
+            return _decode_time(column[row])
+        column = self._endpoints.get(attr)
+        if column is None:
+            return None
+        value = column[row]
+        if value == -1:
+            return None
+        if value < -1:
+            return RecordView(self, -value - 2)
+        return self._terms[value]
+
+    def get_attributes(self, row):
+        """
+        the PROV attributes of a row that are set, as a dictionary
+        """
+        attributes = {}
+        for attr in self._endpoints.keys() + self._times.keys():
+            value = self.get_attribute(row, attr)
+            if value is not None:
+                attributes[attr] = value
+        return attributes
+
+    def get_extra_attributes(self, row):
+        start, end = self._extra_offsets[row], self._extra_offsets[row + 1]
+        return [(self._terms[self._extra_keys[position]], self._extra_values[position])
+                for position in xrange(start, end)]
+
+    # Scans and filters
+    def rows(self, *record_types):
+        """
+        rows of the records of the given types, all by default
+        """
+        if not record_types:
+            return iter(xrange(len(self._types)))
+        wanted = set(record_types)
+        return (row for row, record_type in enumerate(self._types) if record_type in wanted)
+
+    def records(self, *record_types):
+        """
+        RecordView objects of the records of the given types, all by default
+        """
+        return (RecordView(self, row) for row in self.rows(*record_types))
+
+    def find(self, attr, value, *record_types):
+        """
+        RecordView objects of the records whose PROV attribute attr refers to value
+
+        value is a record, an identifier or a RecordView, e.g. the generations
+        of an entity with find(PROV_ATTR_ENTITY, entity, PROV_REC_GENERATION).
+        """
+        column = self._endpoints.get(attr)
+        if column is None:
+            return
+        if isinstance(value, RecordView):
+            term = self._identifiers[value._row]
+            code = term if term >= 0 else -(value._row + 2)
+        else:
+            code = self._find_term(value)
+            if code < 0:
+                return
+        wanted = set(record_types)
+        types = self._types
+        for row, endpoint in enumerate(column):
+            if endpoint == code and (not wanted or types[row] in wanted):
+                yield RecordView(self, row)
+
+    # Lineage
+    def _get_lineage(self):
+        """
+        (upstream, downstream) adjacency of the rows: per relation type, the
+        offsets and the (element row, relation row) pairs, sorted by subject
+        or object row
+        """
+        if self._lineage is not None:
+            return self._lineage
+        count = len(self._types)
+        term_rows = self._term_rows
+        edges = collections.defaultdict(list)
+
+        def endpoint_row(code):
+            if code >= 0:
+                return term_rows[code]
+            return -code - 2 if code < -1 else -1
+
+        for rec_type, (subject_attr, object_attrs) in prov.PROV_LINEAGE_ATTRIBUTES.iteritems():
+            subjects = self._endpoints.get(subject_attr)
+            if subjects is None:
+                continue
+            objects = [self._endpoints[attr] for attr in object_attrs if attr in self._endpoints]
+            for row in self.rows(rec_type):
+                subject = endpoint_row(subjects[row])
+                if subject < 0:
+                    continue
+                for column in objects:
+                    target = endpoint_row(column[row])
+                    if target >= 0:
+                        edges[rec_type].append((subject, target))
+
+        lineage = ({}, {})
+        for rec_type, pairs in edges.iteritems():
+            for direction, (source_position, target_position) in enumerate(((0, 1), (1, 0))):
+                offsets = array.array('l', [0]) * (count + 1)
+                for pair in pairs:
+                    offsets[pair[source_position] + 1] += 1
+                for row in xrange(count):
+                    offsets[row + 1] += offsets[row]
+                targets = array.array('i', [0]) * len(pairs)
+                filled = array.array('l', offsets)
+                for pair in pairs:
+                    source = pair[source_position]
+                    targets[filled[source]] = pair[target_position]
+                    filled[source] += 1
+                lineage[direction][rec_type] = (offsets, targets)
+        self._lineage = lineage
+        return lineage
+
+    def _traverse(self, start, max_depth, relation_types, direction):
+        row = start._row if isinstance(start, RecordView) else self.get_row(start)
+        if row < 0:
+            return
+        adjacency = self._get_lineage()[direction]
+        if relation_types is not None:
+            adjacency = dict((rec_type, adjacency[rec_type]) for rec_type in relation_types if rec_type in adjacency)
+        adjacency = adjacency.values()
+        seen = bytearray(len(self._types))
+        seen[row] = 1
+        queue = collections.deque([(row, 0)])
+        while queue:
+            row, depth = queue.popleft()
+            if max_depth is not None and depth >= max_depth:
+                continue
+            for offsets, targets in adjacency:
+                for position in xrange(offsets[row], offsets[row + 1]):
+                    target = targets[position]
+                    if not seen[target]:
+                        seen[target] = 1
+                        queue.append((target, depth + 1))
+                        yield RecordView(self, target)
+
+    def ancestors(self, element, max_depth=None, relation_types=None):
+        """
+        RecordView objects of the elements element depends on, nearest first, like ProvBundle.ancestors
+
+        Only the records of this store are followed, not those of its sub-bundles.
+        """
+        return self._traverse(element, max_depth, relation_types, 0)
+
+    def descendants(self, element, max_depth=None, relation_types=None):
+        """
+        RecordView objects of the elements depending on element, nearest first, like ProvBundle.descendants
+        """
+        return self._traverse(element, max_depth, relation_types, 1)
+
+    # Materialisation
+    def to_bundle(self, rows=None, bundle=None):
+        """
+        ProvBundle with the records of the given rows, all by default
+
+        The records the rows refer to are added too. With bundle, the records
+        are added to that bundle instead of a new one.
+        """
+        if bundle is None:
+            bundle = prov.ProvBundle()
+            default = self._namespaces.get_default_namespace()
+            if default is not None:
+                bundle.set_default_namespace(default.get_uri())
+            for namespace in self._namespaces.get_registered_namespaces():
+                bundle.add_namespace(namespace)
+        self._materialize(bundle, xrange(len(self._types)) if rows is None else rows)
+        return bundle
+
+    def _materialize(self, bundle, rows):
+        """
+        add the records of rows, and those they refer to, to bundle, returns row -> ProvRecord
+        """
+        records = {}
+        # the rows referred to first, elements before relations
+        pending = []
+        seen = set()
+        stack = list(rows)
+        while stack:
+            row = stack.pop()
+            if row in seen:
+                continue
+            seen.add(row)
+            pending.append(row)
+            for column in self._endpoints.itervalues():
+                code = column[row]
+                if code >= 0:
+                    referred = self._term_rows[code]
+                    if referred >= 0:
+                        stack.append(referred)
+                elif code < -1:
+                    stack.append(-code - 2)
+        pending.sort(key=lambda row: (self._types[row] not in prov.PROV_ELEMENT_TYPES, row))
+
+        for row in pending:
+            attributes = {}
+            for attr, column in self._endpoints.iteritems():
+                code = column[row]
+                if code >= 0:
+                    attributes[attr] = self._terms[code]
+                elif code < -1:
+                    attributes[attr] = records.get(-code - 2)
+            for attr, column in self._times.iteritems():
+                time = _decode_time(column[row])
+                if time is not None:
+                    attributes[attr] = time
+            record_type = self._types[row]
+            identifier = self.get_identifier(row)
+            if record_type == prov.PROV_REC_BUNDLE:
+                record = bundle.bundle(identifier, self.get_extra_attributes(row))
+                nested = self._bundles.get(self._identifiers[row])
+                if nested is not None:
+                    nested._materialize(record, xrange(len(nested)))
+            else:
+                record = bundle.add_record(record_type, identifier, attributes, self.get_extra_attributes(row))
+            records[row] = record
+        return records
+
+
+class RecordView(object):
+    """
+    A row of a ColumnarBundle, with read access to the record's data
+    """
+    __slots__ = ('_store', '_row')
+
+    def __init__(self, store, row):
+        self._store = store
+        self._row = row
+
+    def __repr__(self):
+        return '<RecordView %d: %s %s>' % (self._row, prov.PROV_N_MAP[self.get_type()], self.get_identifier())
+
+    def __eq__(self, other):
+        return isinstance(other, RecordView) and self._store is other._store and self._row == other._row
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((id(self._store), self._row))
+
+    def get_row(self):
+        return self._row
+
+    def get_type(self):
+        return self._store.get_type(self._row)
+
+    def get_identifier(self):
+        return self._store.get_identifier(self._row)
+
+    def get_attribute(self, attr):
+        return self._store.get_attribute(self._row, attr)
+
+    def get_attributes(self):
+        return self._store.get_attributes(self._row)
+
+    def get_extra_attributes(self):
+        return self._store.get_extra_attributes(self._row)
+
+    def is_element(self):
+        return self.get_type() in prov.PROV_ELEMENT_TYPES
+
+    def is_relation(self):
+        return not self.is_element()
+
+    def to_record(self, bundle=None):
+        """
+        materialise the record as a ProvRecord, in a new bundle with the records it refers to by default
+        """
+        if bundle is None:
+            bundle = self._store.to_bundle([])
+        return self._store._materialize(bundle, [self._row])[self._row]
@@ -0,0 +1,189 @@
+"""
+Bulk ingest of directories of provenance.json files
+
+Files are parsed and validated by a pool of processes, and the decoded bundles
+are handed through a bounded queue to a set of uploader threads. Uploaded files
+are recorded in a checkpoint file so that an interrupted ingest can be resumed.
+
+Example:
+
+    python -m provbulbs.ingest --url http://<your-rexster-graph-url> /data/provenance
+"""
+__author__ = 'nolan'
+
+import argparse
+import fnmatch
+import multiprocessing
+import os
+import Queue
+import sys
+import threading
+import time
+
+from instrument import Instrumentation
+from interface import Interface, Config, EidCache
+import prov
+
+
+def find_files(directory, pattern='provenance.json'):
+    """
+    walk a directory for the files matching pattern
+    """
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for name in sorted(fnmatch.filter(files, pattern)):
+            yield os.path.join(root, name)
+
+
+def _parse_file(path):
+    """
+    parse and validate a provenance file, returns (path, bundle, error)
+    """
+    try:
+        with open(path) as f:
+            return path, prov.ProvBundle.load_stream(f), None
+    except Exception, e:
+        return path, None, '%s: %s' % (e.__class__.__name__, e)
+
+
+def _count_records(bundle):
+    """
+    number of records of a bundle, including those of its nested bundles
+    """
+    return len(bundle.get_records()) + sum(_count_records(nested)
+                                           for nested in bundle.get_records_by_type(prov.PROV_REC_BUNDLE))
+
+
+class Checkpoint(object):
+    """
+    Append-only record of the files that have been ingested
+    """
+    def __init__(self, path):
+        self._path = path
+        self._lock = threading.Lock()
+        self.done = set()
+        if os.path.exists(path):
+            with open(path) as f:
+                self.done.update(line.rstrip('\n') for line in f)
+        self._file = open(path, 'a')
+
+    def mark(self, path):
+        with self._lock:
+            self._file.write(path + '\n')
+            self._file.flush()
+            self.done.add(path)
+
+    def close(self):
+        self._file.close()
+
+
+def ingest(paths, config, processes=None, uploaders=4, queue_size=32,
+           checkpoint=None, batch_size=500, sync=False, payload_bytes=False):
+    """
+    parse paths in a process pool and upload the bundles with uploader threads
+
+    returns a dictionary of statistics about the ingest, including the
+    instrumentation snapshot of the uploads, with the bytes sent when
+    payload_bytes is set. Files with records that could not be uploaded
+    are failures and are not checkpointed.
+    """
+    if checkpoint is not None:
+        paths = [path for path in paths if path not in checkpoint.done]
+    stats = {'files': 0, 'records': 0, 'failures': {}}
+    lock = threading.Lock()
+    bundles = Queue.Queue(queue_size)
+    cache = EidCache()
+    instrumentation = Instrumentation(payload_bytes=payload_bytes)
+
+    def upload():
+        interface = Interface(config, cache=cache, instrumentation=instrumentation)
+        while True:
+            item = bundles.get()
+            if item is None:
+                return
+            path, bundle = item
+            try:
+                interface.process_bundle(bundle, batch_size=batch_size, sync=sync)
+            except Exception, e:
+                with lock:
+                    stats['failures'][path] = '%s: %s' % (e.__class__.__name__, e)
+                continue
+            if interface.errors:
+                # e.g. relations without both endpoints, the file is not checkpointed
+                errors = sorted('%s: %s' % (error.__class__.__name__, error) for error in interface.errors.values())
+                with lock:
+                    stats['failures'][path] = '%d failed records: %s' % (len(errors), '; '.join(errors))
+                continue
+            if checkpoint is not None:
+                checkpoint.mark(path)
+            with lock:
+                stats['files'] += 1
+                stats['records'] += _count_records(bundle)
+
+    threads = [threading.Thread(target=upload) for i in range(uploaders)]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+
+    start = time.time()
+    pool = multiprocessing.Pool(processes)
+    try:
+        for path, bundle, error in pool.imap_unordered(_parse_file, paths):
+            if error is None:
+                # blocks while the uploaders are behind
+                bundles.put((path, bundle))
+            else:
+                with lock:
+                    stats['failures'][path] = error
+    finally:
+        pool.close()
+        pool.join()
+        for thread in threads:
+            bundles.put(None)
+        for thread in threads:
+            thread.join()
+    stats['elapsed'] = time.time() - start
+    stats['instrumentation'] = instrumentation.snapshot()
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Ingest directories of PROV-JSON files into a Rexster graph.')
+    parser.add_argument('directories', nargs='+', help='directories to search for provenance files')
+    parser.add_argument('--url', required=True, help='Rexster graph URL')
+    parser.add_argument('--pattern', default='provenance.json', help='file name pattern (default: %(default)s)')
+    parser.add_argument('--processes', type=int, default=None, help='parser processes (default: one per CPU)')
+    parser.add_argument('--uploaders', type=int, default=4, help='uploader threads (default: %(default)s)')
+    parser.add_argument('--queue-size', type=int, default=32, help='parsed bundles waiting for upload (default: %(default)s)')
+    parser.add_argument('--batch-size', type=int, default=500, help='records per Gremlin script (default: %(default)s)')
+    parser.add_argument('--sync', action='store_true', help='skip records already in the graph')
+    parser.add_argument('--payload-bytes', action='store_true', help='measure the bytes sent to the graph')
+    parser.add_argument('--checkpoint', default='ingest.checkpoint', help='checkpoint file (default: %(default)s)')
+    args = parser.parse_args(argv)
+
+    paths = [path for directory in args.directories for path in find_files(directory, args.pattern)]
+    checkpoint = Checkpoint(args.checkpoint)
+    skipped = len([path for path in paths if path in checkpoint.done])
+    try:
+        stats = ingest(paths, Config(args.url), processes=args.processes, uploaders=args.uploaders,
+                       queue_size=args.queue_size, checkpoint=checkpoint,
+                       batch_size=args.batch_size, sync=args.sync, payload_bytes=args.payload_bytes)
+    finally:
+        checkpoint.close()
+
+    elapsed = stats['elapsed'] or 1e-9
+    print 'files: %d ingested, %d failed, %d skipped (already in %s)' % (
+        stats['files'], len(stats['failures']), skipped, args.checkpoint)
+    print 'records: %d in %.1fs (%.1f files/s, %.1f records/s)' % (
+        stats['records'], stats['elapsed'], stats['files'] / elapsed, stats['records'] / elapsed)
+    if args.payload_bytes:
+        print 'graph: %(round_trips)d round trips, %(bytes)d bytes sent' % stats['instrumentation']
+    else:
+        print 'graph: %(round_trips)d round trips' % stats['instrumentation']
+    for path, error in sorted(stats['failures'].items()):
+        print 'failed: %s (%s)' % (path, error)
+    return 1 if stats['failures'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
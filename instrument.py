@@ -0,0 +1,120 @@
+"""
+Instrumentation of the ingest stages of an Interface
+
+Collects per-stage timers, round trips to the graph, payload bytes and record
+throughput. Nothing is printed: the figures are read with snapshot() or sent
+to a logger.
+"""
+__author__ = 'nolan'
+
+import contextlib
+import json
+import logging
+import threading
+import time
+
+# stages timed by Interface
+PARSE = 'parse'
+TRANSFORM = 'transform'
+ELEMENT_CREATE = 'element_create'
+EDGE_CREATE = 'edge_create'
+PROPERTY_UPDATE = 'property_update'
+INDEX_LOOKUP = 'index_lookup'
+BATCH_CREATE = 'batch_create'
+SYNC_LOOKUP = 'sync_lookup'
+
+
+def payload_size(payload):
+    """
+    size in bytes of a request payload once serialized to JSON
+    """
+    return len(json.dumps(payload, default=unicode))
+
+
+class Instrumentation(object):
+    """
+    Thread-safe timers and counters, shared by an Interface and its sessions
+
+    When a logger is given every timed stage is also logged at DEBUG level.
+    Payload bytes cost a JSON serialization of every request and are only
+    measured with payload_bytes=True, they are 0 otherwise.
+
+    Example:
+
+    >>> interface = Interface(config, instrument=True)
+    >>> interface.process_bundle(bundle, batch_size=500)
+    >>> interface.instrumentation.snapshot()['stages']['batch_create']
+    {'calls': 1, 'seconds': 0.41}
+    >>> interface.instrumentation.report(logging.getLogger('ingest'))
+    """
+    def __init__(self, logger=None, payload_bytes=False):
+        self.logger = logger
+        self.payload_bytes = payload_bytes
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            # stage -> [calls, seconds]
+            self._stages = {}
+            self._round_trips = 0
+            self._bytes = 0
+            self._records = 0
+            self._started = time.time()
+
+    @contextlib.contextmanager
+    def stage(self, name, round_trips=0, payload=None):
+        """
+        time the enclosed block as one call of a stage
+
+        round_trips is the number of requests made to the graph and payload
+        the data sent with them, measured when payload_bytes is set.
+        """
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add(name, time.time() - start, round_trips, payload)
+
+    def add(self, name, seconds, round_trips=0, payload=None):
+        size = payload_size(payload) if self.payload_bytes and payload is not None else 0
+        with self._lock:
+            totals = self._stages.setdefault(name, [0, 0.0])
+            totals[0] += 1
+            totals[1] += seconds
+            self._round_trips += round_trips
+            self._bytes += size
+        if self.logger is not None:
+            self.logger.debug('%s: %.6fs, %d round trips, %d bytes', name, seconds, round_trips, size)
+
+    def count_records(self, count=1):
+        with self._lock:
+            self._records += count
+
+    def snapshot(self):
+        """
+        return the figures collected since the last reset as a dictionary
+        """
+        with self._lock:
+            elapsed = time.time() - self._started
+            return {
+                'stages': dict((name, {'calls': calls, 'seconds': seconds})
+                               for name, (calls, seconds) in self._stages.items()),
+                'round_trips': self._round_trips,
+                'bytes': self._bytes,
+                'records': self._records,
+                'elapsed': elapsed,
+                'records_per_second': self._records / elapsed if elapsed else 0.0,
+            }
+
+    def report(self, logger=None, level=logging.INFO):
+        """
+        log a summary of the snapshot, to the instrumentation's logger by default
+        """
+        logger = logger or self.logger or logging.getLogger(__name__)
+        figures = self.snapshot()
+        logger.log(level, '%d records in %.3fs (%.1f records/s), %d round trips, %d bytes',
+                   figures['records'], figures['elapsed'], figures['records_per_second'],
+                   figures['round_trips'], figures['bytes'])
+        for name, totals in sorted(figures['stages'].items()):
+            logger.log(level, '%s: %d calls, %.3fs', name, totals['calls'], totals['seconds'])
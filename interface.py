@@ -3,13 +3,117 @@ Provides i/o for persisting and retrieving provenance.json files using provpy an
 """
 __author__ = 'nolan'
 
+import calendar
+import logging
+import multiprocessing
+import Queue
+import threading
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
+
 from model import *
 
 #ProvEntity, ProvActivity, ProvAgent, ProvAssociation, ProvGeneration, ProvUsage
 
 from bulbs.rexster import Graph, Config
+from bulbs.utils import current_datetime
+from instrument import Instrumentation
+import instrument
+from mapper import MAPPERS, CREATE_PROPERTIES, MissingEndpointError
+from spool import Spool, SpoolDrainer
 import prov
 
+logger = logging.getLogger(__name__)
+
+# Server-side ingest of a compiled batch: creates and indexes all the vertices,
+# then all the edges, and returns a map of record key -> eid. Endpoints created
+# by earlier batches are passed in through 'known'.
+BATCH_SCRIPT = """
+def eids = [:]
+eids.putAll(known)
+for (v in vertices) {
+    def vertex = g.addVertex(null, v.data)
+    g.idx(v.index).put('identifier', v.data.identifier, vertex)
+    eids[v.key] = vertex.id
+}
+for (e in edges) {
+    def edge = g.addEdge(null, g.v(eids[e.outV]), g.v(eids[e.inV]), e.label, e.data)
+    g.idx(e.label).put('identifier', e.data.identifier, edge)
+    g.idx(e.label).put('digest', e.data.digest, edge)
+    eids[e.key] = edge.id
+}
+eids
+"""
+
+# Finds already persisted records by an indexed property and returns a map of
+# record key -> [eid, digest]. The n-th of several identical unnamed relations
+# is matched to the n-th edge with their digest.
+SYNC_SCRIPT = """
+def found = [:]
+for (l in lookups) {
+    def position = 0
+    for (element in g.idx(l.index).get(l.property, l.value)) {
+        if (position++ == l.occurrence) {
+            found[l.key] = [element.id, element.getProperty('digest')]
+            break
+        }
+    }
+}
+found
+"""
+
+# number of records looked up per SYNC_SCRIPT request
+SYNC_LOOKUP_SIZE = 1000
+
+# proxy name -> model class, registered on the graph on first access
+PROXY_MODELS = dict((mapper.proxy, mapper.model) for mapper in MAPPERS.values())
+
+
+def _load_bundle(prov_json):
+    """
+    parse a prov.json file using provpy
+    """
+    with open(prov_json) as f:
+        return prov.ProvBundle.load_stream(f)
+
+
+class EidCache(object):
+    """
+    Bounded LRU map of element identifier (URI) -> eid, safe to share between threads
+    """
+    def __init__(self, size=10000):
+        self._size = size
+        self._eids = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._eids)
+
+    def __contains__(self, identifier):
+        return identifier in self._eids
+
+    def get(self, identifier):
+        with self._lock:
+            eid = self._eids.pop(identifier, None)
+            if eid is not None:
+                # move to the most recently used end
+                self._eids[identifier] = eid
+            return eid
+
+    def put(self, identifier, eid):
+        with self._lock:
+            self._eids.pop(identifier, None)
+            self._eids[identifier] = eid
+            while len(self._eids) > self._size:
+                self._eids.popitem(last=False)
+
+    def invalidate(self, identifier=None):
+        with self._lock:
+            if identifier is None:
+                self._eids.clear()
+            else:
+                self._eids.pop(identifier, None)
+
 
 class Interface(object):
     """
@@ -22,31 +126,100 @@ class Interface(object):
     >>> interface = Interface(config)
     >>> interface.parse_prov("provenance.json")
     >>> interface.process_bundle()
+
+    Large bundles can be ingested in a few round trips instead:
+
+    >>> interface.process_bundle(batch_size=500)
+
+    or spooled to disk and ingested in the background:
+
+    >>> interface = Interface(config, spool="provenance.spool")
+    >>> drainer = interface.start_drainer()
+    >>> interface.spool_bundle(bundle)
+
+    The graph connection is opened and the proxies registered on first use.
+    Long running services can do it up front instead:
+
+    >>> interface = Interface(config).warm_up()
+
+    Time spent in each ingest stage and round trips are collected in
+    interface.instrumentation, see instrument.Instrumentation. Payload bytes
+    are only measured with instrument=True, as every request is serialized
+    once more to count them.
+
+    Any class with the bulbs Graph API can be used instead of Rexster, e.g.
+    the in-process graph of memory.py:
+
+    >>> interface = Interface(memory.Store(latency=0.002), graph_class=memory.MemoryGraph)
     """
-    def __init__(self, config):
-        self._graph = Graph(config)
-        self._set_entity_proxy()
-        self._set_activity_proxy()
-        self._set_generation_proxy()
-        self._set_usage_proxy()
-        self._set_communication_proxy()
-        self._set_start_proxy()
-        self._set_end_proxy()
-        self._set_invalidation_proxy()
-        self._set_derivation_proxy()
-        self._set_agent_proxy()
-        self._set_attribution_proxy()
-        self._set_association_proxy()
-        self._set_delegation_proxy()
-        self._set_influence_proxy()
-        self._set_specialization_proxy()
-        self._set_alternate_proxy()
-        self._set_mention_proxy()
-        self._set_membership_proxy()
-        self._set_bundle_proxy()
+    def __init__(self, config, cache_size=10000, cache=None, spool=None, instrumentation=None,
+                 graph_class=Graph, instrument=False):
+        self._config = config
+        self._graph_class = graph_class
+        if instrumentation is None:
+            instrumentation = Instrumentation(payload_bytes=instrument)
+        self.instrumentation = instrumentation
+        self._spool = Spool(spool) if spool else None
+        self._cache = cache if cache is not None else EidCache(cache_size)
+        # idle sessions used by concurrent uploads, see _session
+        self._sessions = Queue.Queue()
+        self.errors = {}
+        # guards the lazy creation of the graph and its proxies, see __getattr__
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        """
+        open the graph connection and register the proxies on first use
+        """
+        if name == '_graph':
+            with self._lock:
+                if '_graph' not in self.__dict__:
+                    self.__dict__['_graph'] = self._graph_class(self._config)
+                return self.__dict__['_graph']
+        model = PROXY_MODELS.get(name)
+        if model is None:
+            raise AttributeError(name)
+        graph = self._graph
+        with self._lock:
+            if name not in self.__dict__:
+                graph.add_proxy(name, model)
+                self.__dict__[name] = getattr(graph, name)
+            return self.__dict__[name]
+
+    def warm_up(self):
+        """
+        open the graph connection and register all the proxies up front
+
+        For long running services that would rather not pay for it on their first request.
+        """
+        for name in PROXY_MODELS:
+            getattr(self, name)
+        return self
+
+    def _register_indices(self, records):
+        """
+        register the proxies of the record types of (key, record) pairs
+
+        Registering a proxy creates its manual index, which the Gremlin
+        scripts use directly and which must exist before they run.
+        """
+        for name in set(MAPPERS[record.get_type()].proxy for key, record in records):
+            getattr(self, name)
 
     def close_connection(self):
-        del self._graph
+        with self._lock:
+            for name in ['_graph'] + PROXY_MODELS.keys():
+                self.__dict__.pop(name, None)
+
+    def invalidate_cache(self, identifier=None):
+        """
+        forget the cached eid of an identifier, or of all identifiers
+
+        Must be called when vertices are removed from the graph behind the interface's back.
+        """
+        if isinstance(identifier, prov.Identifier):
+            identifier = identifier.get_uri()
+        self._cache.invalidate(identifier)
 
     def parse_prov (self, prov_json):
         """
@@ -56,399 +229,551 @@ class Interface(object):
 
         return parsed bundle
         """
-        self._bundle = prov.json.load(open(prov_json), cls = prov.ProvBundle.JSONDecoder)
+        with self.instrumentation.stage(instrument.PARSE):
+            self._bundle = _load_bundle(prov_json)
         return self._bundle
 
-    def _upload_lookup(self, proxy_type):
+    def _upload_lookup(self, record):
+        """
+        method to lookup the upload function for a given record
+        """
+        if record.is_element():
+            return self._upload_element
+        return self._upload_relation
+
+    def _record_key(self, record, occurrence=0):
+        """
+        key used for a record in the responses of process_bundle
+
+        Identical unnamed relations have the same digest and are told apart
+        by their occurrence, see _keyed_records.
+        """
+        identifier = record.get_identifier()
+        if identifier:
+            return identifier.get_uri()
+        if occurrence:
+            return 'rel_%s_%d' % (record.get_digest(), occurrence)
+        return 'rel_' + record.get_digest()
+
+    def _keyed_records(self, records):
+        """
+        (key, record) pairs of records, numbering the occurrences of identical unnamed relations
+
+        A record given more than once keeps its key.
+        """
+        keys = {}
+        occurrences = {}
+        keyed = []
+        for record in records:
+            key = keys.get(id(record))
+            if key is None:
+                occurrence = 0
+                if not record.get_identifier():
+                    digest = record.get_digest()
+                    occurrence = occurrences.get(digest, 0)
+                    occurrences[digest] = occurrence + 1
+                key = keys[id(record)] = self._record_key(record, occurrence)
+            keyed.append((key, record))
+        return keyed
+
+    def process_bundle(self, bundle=None, batch_size=None, workers=None, sync=False):
+        """
+        upload the records of a bundle to the graph
+
+        By default every record is uploaded through its proxy. When batch_size
+        is given, the bundle is compiled into Gremlin scripts of at most
+        batch_size records each and the returned map is record key -> eid.
+        When workers is given, records are uploaded by a pool of that many
+        threads; failed records are left out of the responses and reported
+        in self.errors instead. In every mode, relations without both of
+        their endpoints cannot be drawn as edges and are reported in
+        self.errors with a MissingEndpointError.
+        With sync, records already in the graph are not uploaded again: they
+        are matched on their identifier (or digest for unnamed relations),
+        left alone if their digest is unchanged and patched otherwise. Only
+        the remaining records are uploaded, in the mode selected above.
         """
-        method to lookup the upload function for a given structure
+        if not bundle:
+            bundle = self.__dict__.get('_bundle')
+            if bundle is None:
+                print "self._bundle is None. Did you run interface.parse_prov(<prov.json>)?"
+                return {}
+        if batch_size or workers or sync:
+            return self.process_bundles([bundle], batch_size, workers, sync)
+        self.errors = {}
+        return self._upload_bundle(bundle)
+
+    def _upload_bundle(self, bundle):
         """
-        return getattr(self, '_upload_' + proxy_type, None)
+        upload the records of a bundle one by one, then those of its nested bundles
 
-    def process_bundle(self, bundle=None):
-        bundle = bundle
+        Errors accumulate in self.errors across the nested bundles.
+        """
         structures = {'element': [],
                      'relation': []}
         responses = {}
-        try:
-            if not bundle:
-                bundle = self._bundle
-            for record in bundle.get_records():
-                if record.is_element():
-                    # TODO logic for processing nested bundles
-                    if isinstance(record,prov.ProvBundle):
-                        structures['element'].append(record)
-                        self.process_bundle(bundle=record)
-                    else:
-                        structures['element'].append(record)
-                elif record.is_relation():
-                    structures['relation'].append(record)
-                else:
-                    pass
-        except AttributeError:
-            print "self._bundle is None. Did you run interface.parse_prov(<prov.json>)?"
+        for record in bundle.get_elements():
+            # TODO logic for processing nested bundles
+            if isinstance(record,prov.ProvBundle):
+                self._upload_bundle(record)
+            structures['element'].append(record)
+        structures['relation'].extend(bundle.get_relations())
 
         # first process all the elements
         for element in structures['element']:
-            element_type = prov.PROV_N_MAP[element.get_type()]
             element_uri = element.get_identifier().get_uri()
-            responses[element_uri] = self._upload_lookup(element_type)(element)
+            responses[element_uri] = self._upload_element(element)
 
         # relations require that elements are created first
-        for relation in structures['relation']:
-            relation_type = prov.PROV_N_MAP[relation.get_type()]
-            relation_id = relation.get_identifier()
-            if relation_id:
-                relation_uri = relation_id.get_uri()
-                responses[relation_uri] = self._upload_lookup(relation_type)(relation)
-            else:
-                relation_uri = 'rel_' + str(hash(relation))
-                responses[relation_uri] = self._upload_lookup(relation_type)(relation)
+        for relation_uri, relation in self._keyed_records(structures['relation']):
+            try:
+                responses[relation_uri] = self._upload_relation(relation)
+            except MissingEndpointError, e:
+                self.errors[relation_uri] = e
 
         return responses
 
-    def _process_attributes(self, record):
-        all_attributes = record.get_attributes()
-        attributes = all_attributes[0]
-        extra_attributes = all_attributes[1]
-        results = {'attrs':{},
-                   'extra':{}}
-
-        if attributes:
-            attrs = {}
-            for k in attributes.keys():
-                print 'attr key:', k
-                if isinstance(k, prov.QName):
-                    key = k.get_namespace().get_prefix() + '_' + k.get_localpart()
-                    if isinstance(attributes[k], prov.QName):
-                        attrs[key] = attributes[k].get_uri()
-                    else:
-                        attrs[key] = attributes[k]
-                else:
-                    if isinstance(k, prov.QName):
-                        attrs[k] = attributes[k].get_uri()
-                    else:
-                        attrs[k] = attributes[k]
-                results['attrs'] = attrs
-
-        if extra_attributes:
-            for k,v in extra_attributes:
-                extra = {}
-                if isinstance(k, prov.QName):
-                    if isinstance(v, prov.QName):
-                        key = k.get_namespace().get_prefix() + '_' + k.get_localpart()
-                        extra[key] = v.get_uri()
-                    else:
-                        key = k.get_namespace().get_prefix() + '_' + k.get_localpart()
-                        extra[key] = v
-                else:
-                    if isinstance(v, prov.QName):
-                        extra[k] = v.get_localpart()
-                    else:
-                        extra[k] = v
-                results['extra'] = extra
-        return results
-
+    def process_bundles(self, bundles, batch_size=None, workers=None, sync=False):
+        """
+        upload the records of several bundles together
 
-### Component 1: Entities and Activities
+        The elements of all the bundles are uploaded before their relations,
+        so a batch_size larger than a single bundle still fills every script.
+        Records are keyed bundle by bundle and a record repeated across the
+        bundles, i.e. with the same key, is uploaded once. See process_bundle
+        for the upload modes.
+        """
+        elements, relations = [], []
+        keys = set()
+        for bundle in bundles:
+            bundle_elements, bundle_relations = [], []
+            self._collect_records(bundle, bundle_elements, bundle_relations)
+            for records, keyed in ((bundle_elements, elements), (bundle_relations, relations)):
+                for key, record in self._keyed_records(records):
+                    if key not in keys:
+                        keys.add(key)
+                        keyed.append((key, record))
+        responses = {}
+        self.errors = {}
+        if sync:
+            elements, relations, responses = self._sync_records(elements, relations)
+        if batch_size:
+            responses.update(self._process_batches(elements, relations, batch_size))
+        elif workers:
+            responses.update(self._process_concurrently(elements, relations, workers))
+        else:
+            for key, record in elements + relations:
+                try:
+                    responses[key] = self._upload_lookup(record)(record)
+                except MissingEndpointError, e:
+                    self.errors[key] = e
+        return responses
 
+### Deferred ingest
 
-    def _set_entity_proxy(self):
-        """
-        initialize entity proxy
+    def spool_bundle(self, bundle=None):
         """
-        self._graph.add_proxy("entities", ProvEntity)
-        self.entities = self._graph.entities
+        append a bundle to the spool and return without touching the graph
 
-    def _upload_entity(self, record):
+        The interface must have been created with a spool path, ValueError is
+        raised otherwise. Returns the spool offset at which the bundle ends;
+        it has been ingested once the spool's acknowledged offset reaches it.
         """
-        parse entity
-        """
-        all_attributes = self._process_attributes(record)
-        attributes = all_attributes['attrs']
-        extra_attributes = all_attributes['extra']
+        if not bundle:
+            bundle = self._bundle
+        return self._get_spool().append(bundle)
 
-        data = dict(
-            identifier = record.get_identifier().get_uri(),
-            provn = record.get_provn(),
-            asserted_types = [type.get_uri() for type in record.get_asserted_types()],
-            attributes = attributes.keys(),
-            extra_attributes = extra_attributes.keys()
-            )
-        response = self.entities.create(data)
+    def _get_spool(self):
+        if self._spool is None:
+            raise ValueError('the interface has no spool, create it with Interface(config, spool=<path>)')
+        return self._spool
 
-        data_update = response.data()
+    def start_drainer(self, **kwargs):
+        """
+        start a background thread replaying the spool to the graph
 
-        for attrs in attributes.iterkeys():
-            if attrs in prov.PROV_ID_ATTRIBUTES_MAP.keys():
-                prov_type = prov.PROV_ID_ATTRIBUTES_MAP[attrs].split(':')[-1]
-            else:
-                prov_type = attrs
-            data_update[prov_type] = attributes[attrs]
+        Keyword arguments are passed to spool.SpoolDrainer. Returns the drainer.
+        """
+        drainer = SpoolDrainer(self._new_session(), self._get_spool(), **kwargs)
+        drainer.start()
+        return drainer
 
-        for extra in extra_attributes.iterkeys():
-            # bulbs reserves the 'label' keyword
-            prov_type = extra
-            data_update[prov_type] = extra_attributes[extra]
+    def _lookup(self, proxy, **properties):
+        """
+        look up vertices or edges by an indexed property on a pooled session
+        """
+        session = self._session()
+        try:
+            with self.instrumentation.stage(instrument.INDEX_LOOKUP, 1):
+                return list(getattr(session, proxy).index.lookup(**properties) or [])
+        finally:
+            self._sessions.put(session)
 
-        if record.is_element:
-            self._graph.vertices.update(response.eid,data_update)
+### Concurrent ingest
 
-        elif record.is_relation:
-            self._graph.edges.update(response.eid,data_update)
+    def _session(self):
+        """
+        take an idle session (an Interface with its own HTTP connection) from the pool
+        """
+        try:
+            return self._sessions.get_nowait()
+        except Queue.Empty:
+            return self._new_session()
 
-        print 'entity:',response.eid
-        return response
+    def _new_session(self):
+        """
+        an Interface on the same graph sharing the eid cache and the instrumentation
+        """
+        return Interface(self._config, cache=self._cache, instrumentation=self.instrumentation,
+                         graph_class=self._graph_class)
 
-    def _set_activity_proxy(self):
-        self._graph.add_proxy("activities", ProvActivity)
-        self.activities = self._graph.activities
+    def _upload_record(self, keyed):
+        """
+        upload a single (key, record) on a pooled session, returning (key, response, error)
+        """
+        key, record = keyed
+        session = self._session()
+        try:
+            return key, session._upload_lookup(record)(record), None
+        except Exception, e:
+            return key, None, e
+        finally:
+            self._sessions.put(session)
 
-    def _upload_activity(self, record):
+    def _process_concurrently(self, elements, relations, workers):
         """
-        parse activity
+        upload (key, record) pairs of elements, then of relations, each phase on a pool of worker threads
         """
-        all_attributes = self._process_attributes(record)
-        attributes = all_attributes['attrs']
-        extra_attributes = all_attributes['extra']
+        responses = {}
+        pool = ThreadPool(workers)
+        try:
+            # map returns only once the whole phase is done, so relations never
+            # start before the elements they connect have been created
+            for phase in (elements, relations):
+                for key, response, error in pool.map(self._upload_record, phase):
+                    if error is None:
+                        responses[key] = response
+                    else:
+                        self.errors[key] = error
+        finally:
+            pool.close()
+            pool.join()
+        return responses
 
-        data = dict(
-            identifier = record.get_identifier().get_uri(),
-            provn = record.get_provn(),
-            asserted_types = [type.get_uri() for type in record.get_asserted_types()],
-            attributes = attributes.keys(),
-            extra_attributes = extra_attributes.keys()
-        )
-        response = self.activities.create(data)
+### Incremental sync
 
-        data_update = response.data()
+    def _sync_records(self, elements, relations):
+        """
+        split (key, record) pairs into the ones to upload and the ones already persisted
 
-        for attrs in attributes.iterkeys():
-            if attrs in prov.PROV_ID_ATTRIBUTES_MAP.keys():
-                prov_type = prov.PROV_ID_ATTRIBUTES_MAP[attrs].split(':')[-1]
+        Persisted records whose digest changed are patched in place. Returns
+        the elements and relations left to upload and the record key -> eid
+        map of the persisted ones.
+        """
+        records = OrderedDict(elements + relations)
+        occurrences = {}
+        lookups = []
+        for key, record in records.iteritems():
+            index = MAPPERS[record.get_type()].index
+            if record.get_identifier():
+                lookups.append(dict(key=key, index=index, property='identifier', value=key, occurrence=0))
             else:
-                prov_type = attrs
-            data_update[prov_type] = attributes[attrs]
-
-        for extra in extra_attributes.iterkeys():
-            # bulbs reserves the 'label' keyword
-            prov_type = extra
-            data_update[prov_type] = extra_attributes[extra]
-
-        if record.is_element:
-            self._graph.vertices.update(response.eid,data_update)
-
-        elif record.is_relation:
-            self._graph.edges.update(response.eid,data_update)
+                # the n-th identical unnamed relation matches the n-th edge with its digest
+                digest = record.get_digest()
+                occurrence = occurrences.get(digest, 0)
+                occurrences[digest] = occurrence + 1
+                lookups.append(dict(key=key, index=index, property='digest', value=digest,
+                                    occurrence=occurrence))
+
+        self._register_indices(records.iteritems())
+        found = {}
+        for start in range(0, len(lookups), SYNC_LOOKUP_SIZE):
+            params = dict(lookups=lookups[start:start + SYNC_LOOKUP_SIZE])
+            with self.instrumentation.stage(instrument.SYNC_LOOKUP, 1, params):
+                response = self._graph.gremlin.execute(SYNC_SCRIPT, params)
+            results = response.content['results']
+            if results:
+                found.update(results[0])
 
-        print 'activity:',response.eid
-        return response
-
-    def _set_generation_proxy(self):
-        self._graph.add_proxy("wasGeneratedBy", ProvGeneration)
-        self.wasGeneratedBy = self._graph.wasGeneratedBy
+        responses = {}
+        pending = ([], [])
+        for key, record in records.iteritems():
+            if key not in found:
+                pending[0 if record.is_element() else 1].append((key, record))
+                continue
+            eid, digest = found[key]
+            if record.is_element():
+                self._cache.put(key, eid)
+            if digest != record.get_digest():
+                data = self._record_data(record)
+                with self.instrumentation.stage(instrument.PROPERTY_UPDATE, 1, data):
+                    if record.is_element():
+                        self._graph.vertices.update(eid, data)
+                    else:
+                        self._graph.edges.update(eid, data)
+            responses[key] = eid
+        self.instrumentation.count_records(len(responses))
+        return pending[0], pending[1], responses
 
-    def _upload_wasGeneratedBy(self,record):
-        all_attributes = self._process_attributes(record)
-        attributes = all_attributes['attrs']
-        extra_attributes = all_attributes['extra']
+### Batched ingest
 
-        if record.get_identifier():
-            identifier = record.get_identifier().get_uri()
-        else:
-            identifier = record.get_identifier()
+    def _collect_records(self, bundle, elements, relations):
+        """
+        split the records of a bundle, including nested bundles, into elements and relations
+        """
+        for record in bundle.get_elements():
+            elements.append(record)
+            if isinstance(record, prov.ProvBundle):
+                self._collect_records(record, elements, relations)
+        relations.extend(bundle.get_relations())
 
-        # search for entity ids
-        if 1 in attributes.iterkeys():
-            entity_id =  attributes[1].get_identifier().get_uri()
-        else:
-            entity_id =  attributes[1].get_identifier()
+    def _record_data(self, record):
+        """
+        flatten a record into the properties stored on its vertex or edge
+        """
+        data = MAPPERS[record.get_type()].properties(record)
+        data['created'] = calendar.timegm(current_datetime().utctimetuple())
+        return data
 
-        # search for activity ids
-        if 2 in attributes.iterkeys():
-            activity_id = attributes[2].get_identifier().get_uri()
-        else:
-            activity_id = attributes[2].get_identifier()
+    def _compile_vertex(self, key, record):
+        mapper = MAPPERS[record.get_type()]
+        return dict(key=key, index=mapper.index, data=self._record_data(record))
 
-        data = dict(
-            identifier = identifier,
-            entity = entity_id,
-            activity = activity_id,
-            #startTime = None,
-            #endTime = None,
-            provn = record.get_provn(),
-            asserted_types = [type.get_uri() for type in record.get_asserted_types()],
-            attributes = attributes.keys(),
-            extra_attributes = extra_attributes.keys()
-        )
+    def _compile_edge(self, key, record):
+        """
+        return the compiled edge and its endpoint records, see RecordMapper.endpoints
+        """
+        mapper = MAPPERS[record.get_type()]
+        endpoints = mapper.endpoints(record)
+        outV, inV = endpoints
+        edge = dict(key=key, label=mapper.index, data=self._record_data(record),
+                    outV=self._record_key(outV), inV=self._record_key(inV))
+        return edge, endpoints
+
+    def _lookup_eid(self, record):
+        """
+        find the eid of a persisted element, querying the index only on a cache miss
+        """
+        identifier = record.get_identifier().get_uri()
+        eid = self._cache.get(identifier)
+        if eid is None:
+            proxy = getattr(self, MAPPERS[record.get_type()].proxy)
+            with self.instrumentation.stage(instrument.INDEX_LOOKUP, 1):
+                vertices = proxy.index.lookup(identifier=identifier)
+            if vertices is None:
+                return None
+            eid = vertices.next().eid
+            self._cache.put(identifier, eid)
+        return eid
+
+    def _process_batches(self, elements, relations, batch_size):
+        """
+        ingest (key, record) pairs through Gremlin scripts of at most batch_size records
+        """
+        with self.instrumentation.stage(instrument.TRANSFORM):
+            vertices = [(self._compile_vertex(key, element), None) for key, element in elements]
+            edges = []
+            for key, relation in relations:
+                try:
+                    edges.append(self._compile_edge(key, relation))
+                except MissingEndpointError, e:
+                    self.errors[key] = e
+
+        self._register_indices(elements + relations)
+        eids = {}
+        operations = vertices + edges
+        for start in range(0, len(operations), batch_size):
+            batch = operations[start:start + batch_size]
+            batch_vertices = [op for op, endpoints in batch if endpoints is None]
+            batch_edges = [op for op, endpoints in batch if endpoints is not None]
+            created = set(vertex['key'] for vertex in batch_vertices)
+            known = {}
+            for op, endpoints in batch:
+                if endpoints is None:
+                    continue
+                for key, record in zip((op['outV'], op['inV']), endpoints):
+                    if key in created:
+                        continue
+                    if key not in eids:
+                        # endpoint from outside the bundle, resolve it once
+                        eids[key] = self._lookup_eid(record)
+                    known[key] = eids[key]
+            params = dict(vertices=batch_vertices, edges=batch_edges, known=known)
+            with self.instrumentation.stage(instrument.BATCH_CREATE, 1, params):
+                response = self._graph.gremlin.execute(BATCH_SCRIPT, params)
+            results = response.content['results']
+            if results:
+                eids.update(results[0])
+                for key in created:
+                    self._cache.put(key, eids[key])
+                self.instrumentation.count_records(len(batch))
+        return eids
+
+### Record upload
+
+    def _upload_element(self, record):
+        """
+        create the vertex of an element through its proxy
+        """
+        stats = self.instrumentation
+        mapper = MAPPERS[record.get_type()]
+        with stats.stage(instrument.TRANSFORM):
+            data = mapper.properties(record)
+            create_data = dict((key, data[key]) for key in CREATE_PROPERTIES)
+        with stats.stage(instrument.ELEMENT_CREATE, 1, create_data):
+            response = getattr(self, mapper.proxy).create(create_data)
+        # the remaining properties are not declared by every model
+        data_update = response.data()
+        data_update.update(data)
+        with stats.stage(instrument.PROPERTY_UPDATE, 1, data_update):
+            self._graph.vertices.update(response.eid, data_update)
 
+        self._cache.put(data['identifier'], response.eid)
+        stats.count_records()
+        logger.debug('%s: %s', mapper.index, response.eid)
+        return response
 
-        outV = self._graph.activities.index.lookup(identifier=activity_id).next()
-        inV = self._graph.entities.index.lookup(identifier=entity_id).next()
-        response = self.wasGeneratedBy.create(outV,inV,data)
+    def _upload_relation(self, record):
+        """
+        create the edge of a relation through its proxy
 
+        Raises MissingEndpointError for relations without both endpoints, which cannot be drawn as edges.
+        """
+        stats = self.instrumentation
+        mapper = MAPPERS[record.get_type()]
+        with stats.stage(instrument.TRANSFORM):
+            endpoints = mapper.endpoints(record)
+            data = mapper.properties(record)
+            create_data = dict((key, data[key]) for key in CREATE_PROPERTIES)
+        outV, inV = self._lookup_eid(endpoints[0]), self._lookup_eid(endpoints[1])
+        with stats.stage(instrument.EDGE_CREATE, 1, create_data):
+            response = getattr(self, mapper.proxy).create(outV, inV, create_data)
         data_update = response.data()
+        data_update.update(data)
+        with stats.stage(instrument.PROPERTY_UPDATE, 1, data_update):
+            self._graph.edges.update(response.eid, data_update)
 
-        for attrs in attributes.iterkeys():
-            if attrs in prov.PROV_ID_ATTRIBUTES_MAP.keys():
-                prov_type = prov.PROV_ID_ATTRIBUTES_MAP[attrs].split(':')[-1]
-            else:
-                prov_type = attrs
-            data_update[prov_type] = attributes[attrs]
+        stats.count_records()
+        logger.debug('%s: %s', mapper.index, response.eid)
+        return response
 
-        for extra in extra_attributes.iterkeys():
-            # bulbs reserves the 'label' keyword
-            prov_type = extra
-            data_update[prov_type] = extra_attributes[extra]
+    class _ElementProxy(object):
+        def __init__(self):
+            pass
 
-        if record.is_relation:
-            self._graph.edges.update(response.eid,data_update)
 
-        print 'generation:', response.eid
-        return response
+class BundleUpload(object):
+    """
+    Handle on a bundle being uploaded by an AsyncInterface
 
-    def _set_usage_proxy(self):
-        self._graph.add_proxy("used", ProvUsage)
-        self.used = self._graph.used
-
-    def _upload_used(self, record):
-        provn = record.get_provn()
-        activity_id = record.get_attributes()[0][2].get_identifier().get_uri()
-        activity = list(self.activities.index.lookup(identifier=activity_id))[0]
-        entity_id = record.get_attributes()[0][1].get_identifier().get_uri()
-        entity = list(self.entities.index.lookup(identifier=entity_id))[0]
-        response = self.used.create(activity, entity,
-            activity=activity,
-            entity=entity,
-            provn=provn
-        )
-        print 'used:', response.eid
-        return response
+    The upload runs in the background; ready(), wait() and get() mirror
+    multiprocessing's AsyncResult. responses and errors are keyed like the
+    results of Interface.process_bundle.
+    """
+    def __init__(self, submit, elements, relations, callback=None):
+        self.responses = {}
+        self.errors = {}
+        self._submit = submit
+        self._phases = [elements, relations]
+        self._pending = 0
+        self._callback = callback
+        self._lock = threading.Lock()
+        self._event = threading.Event()
+        self._next_phase()
+
+    def _next_phase(self):
+        while self._phases:
+            phase = self._phases.pop(0)
+            if phase:
+                self._pending = len(phase)
+                for keyed in phase:
+                    self._submit(keyed, self._record_done)
+                return
+        # nothing left to upload
+        self._event.set()
+        if self._callback:
+            self._callback(self)
+
+    def _record_done(self, result):
+        key, response, error = result
+        with self._lock:
+            if error is None:
+                self.responses[key] = response
+            else:
+                self.errors[key] = error
+            self._pending -= 1
+            phase_done = self._pending == 0
+        if phase_done:
+            # relations are only submitted once all the elements are created
+            self._next_phase()
 
-    def _set_communication_proxy(self):
-        self._graph.add_proxy("wasInformedBy", ProvCommunication)
-        self.wasInformedBy = self._graph.wasInformedBy
-
-    def _set_start_proxy(self):
-        self._graph.add_proxy("wasStartedBy", ProvStart)
-        self.wasStartedBy = self._graph.wasStartedBy
-
-    def _upload_wasStartedBy(self,record):
-        provn = record.get_provn()
-
-        attributes = record.get_attributes()
-
-        activity_id = attributes[0][2].get_identifier().get_uri()
-        activity = list(self.activities.index.lookup(identifier=activity_id))[0]
-        starter_id = attributes[0][6].get_identifier().get_uri()
-        starter = list(self.activities.index.lookup(identifier=starter_id))[0]
-        response = self.wasStartedBy.create(activity, starter,
-            activity=activity,
-            starter_activity=starter,
-            provn=provn
-        )
-        print 'wasStartedBy:', response.eid
-        return response
+    def ready(self):
+        return self._event.is_set()
 
-    def _set_end_proxy(self):
-        self._graph.add_proxy("wasEndedBy", ProvEnd)
-        self.wasEndedBy = self._graph.wasEndedBy
+    def wait(self, timeout=None):
+        self._event.wait(timeout)
 
-    def _set_invalidation_proxy(self):
-        self._graph.add_proxy("wasInvalidatedBy", ProvInvalidation)
-        self.wasInvalidatedBy = self._graph.wasInvalidatedBy
+    def get(self, timeout=None):
+        self.wait(timeout)
+        if not self.ready():
+            raise multiprocessing.TimeoutError
+        return self.responses
 
-### Component 2: Derivations
 
-    def _set_derivation_proxy(self):
-        self._graph.add_proxy("wasDerivedFrom", ProvDerivation)
-        self.wasDerivedFrom = self._graph.wasDerivedFrom
+class AsyncInterface(object):
+    """
+    Non-blocking interface to the provbulbs model
 
+    All the calls return immediately. Every request is run by one pool of
+    max_requests threads shared by all the uploads, each thread holding at
+    most one pooled connection, so any number of pipeline runs can push
+    provenance at once with at most max_requests requests in flight.
 
-### Component 3: Agents, Responsibility, and Influence
+    Example:
 
-    def _set_agent_proxy(self):
-        self._graph.add_proxy("agents", ProvAgent)
-        self.agents = self._graph.agents
+    >>> interface = AsyncInterface(config, max_requests=32)
+    >>> upload = interface.process_bundle(bundle, callback=on_uploaded)
+    >>> upload.get()
+    """
+    def __init__(self, config, max_requests=16, cache_size=10000, graph_class=Graph):
+        self._interface = Interface(config, cache_size=cache_size, graph_class=graph_class)
+        self.instrumentation = self._interface.instrumentation
+        self._pool = ThreadPool(max_requests)
 
-    def _upload_agent(self, record):
+    def close(self):
         """
-        parse activity
+        wait for the pending requests and release the pool
         """
+        self._pool.close()
+        self._pool.join()
 
-        identifier = record.get_identifier().get_uri()
-        asserted_types = [type.get_uri() for type in record.get_asserted_types()]
-        attributes = record.get_attributes()
-        provn = record.get_provn()
-        response = self.agents.create(identifier=identifier,
-            asserted_types=asserted_types,
-            attributes=attributes[1],
-            provn=provn,
-        )
-        print 'agent:', response.eid
-        return response
-
-    def _set_attribution_proxy(self):
-        self._graph.add_proxy("wasAttributedTo", ProvAttribution)
-        self.wasAttributedTo = self._graph.wasAttributedTo
-
-    def _set_association_proxy(self):
-        self._graph.add_proxy("wasAssociatedWith", ProvAssociation)
-        self.wasAssociatedWith = self._graph.wasAssociatedWith
-
-    def _upload_wasAssociatedWith(self,record):
-        provn = record.get_provn()
-
-        attributes = record.get_attributes()
-
-        activity_id = attributes[0][2].get_identifier().get_uri()
-        activity = list(self.activities.index.lookup(identifier=activity_id))[0]
-        agent_id = attributes[0][8].get_identifier().get_uri()
-        agent = list(self.agents.index.lookup(identifier=agent_id))[0]
-        response = self.wasAssociatedWith.create(activity, agent,
-            activity=activity,
-            agent=agent,
-            provn=provn
-        )
-        print 'wasAssociatedWith:', response.eid
-        return response
-
-    def _set_delegation_proxy(self):
-        self._graph.add_proxy("actedOnBehalfOf", ProvDelegation)
-        self.actedOnBehalfOf = self._graph.actedOnBehalfOf
-
-    def _set_influence_proxy(self):
-        self._graph.add_proxy("wasInfluencedBy", ProvInfluence)
-        self.wasInfluencedBy = self._graph.wasInfluencedBy
-
-### Component 4: Bundles
-
-# See below
-
-### Component 5: Alternate Entities
+    def parse_prov(self, prov_json, callback=None):
+        """
+        parse a prov.json file in the background, returns an AsyncResult of the bundle
+        """
+        return self._pool.apply_async(_load_bundle, (prov_json,), callback=callback)
 
-    def _set_specialization_proxy(self):
-        self._graph.add_proxy("specializationOf", ProvSpecialization)
-        self.specializationOf = self._graph.specializationOf
+    def process_bundle(self, bundle, callback=None):
+        """
+        upload a bundle in the background, returns a BundleUpload
 
-    def _set_alternate_proxy(self):
-        self._graph.add_proxy("alternateOf", ProvAlternate)
-        self.alternateOf = self._graph.alternateOf
+        callback, if given, is called with the BundleUpload once it is complete.
+        """
+        elements, relations = [], []
+        self._interface._collect_records(bundle, elements, relations)
+        keyed = self._interface._keyed_records
+        return BundleUpload(self._submit_record, keyed(elements), keyed(relations), callback)
 
-    def _set_mention_proxy(self):
-        self._graph.add_proxy("mentionOf", ProvMention)
-        self.mentionOf = self._graph.mentionOf
+    def _submit_record(self, keyed, callback):
+        self._pool.apply_async(self._interface._upload_record, (keyed,), callback=callback)
 
-### Component 6: Collections
+    def lookup(self, proxy, callback=None, **properties):
+        """
+        look up vertices or edges by an indexed property in the background
 
-    def _set_membership_proxy(self):
-        self._graph.add_proxy("hadMember", ProvMembership)
-        self.hadMember = self._graph.hadMember
+        Example:
 
-    def _set_bundle_proxy(self):
-        self._graph.add_proxy("bundles", ProvBundle)
-        self.bundles = self._graph.bundles
+        >>> interface.lookup('agents', identifier='http://nipy.org/nipype/terms/0.6/ag1').get()
+        """
+        return self._pool.apply_async(self._interface._lookup, (proxy,), properties, callback=callback)
 
-    class _ElementProxy(object):
-        def __init__(self):
-            pass
\ No newline at end of file
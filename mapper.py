@@ -0,0 +1,183 @@
+"""
+Compiled mappings from provpy records to the properties of the provbulbs model
+
+Each PROV record type gets a RecordMapper that is built once from the model
+class persisting it, so that turning a record into vertex or edge properties
+does not re-derive property names for every attribute.
+"""
+__author__ = 'nolan'
+
+import datetime
+
+from model import *
+import prov
+
+# PROV record type: (Interface proxy, model class, outV attributes, inV attributes)
+# Relations are drawn between the first endpoints of each list that are present.
+RECORD_MAPPINGS = {
+    prov.PROV_REC_ENTITY: ('entities', ProvEntity, None, None),
+    prov.PROV_REC_ACTIVITY: ('activities', ProvActivity, None, None),
+    prov.PROV_REC_AGENT: ('agents', ProvAgent, None, None),
+    prov.PROV_REC_BUNDLE: ('bundles', ProvBundle, None, None),
+    prov.PROV_REC_GENERATION: ('wasGeneratedBy', ProvGeneration,
+        (prov.PROV_ATTR_ACTIVITY,), (prov.PROV_ATTR_ENTITY,)),
+    prov.PROV_REC_USAGE: ('used', ProvUsage,
+        (prov.PROV_ATTR_ACTIVITY,), (prov.PROV_ATTR_ENTITY,)),
+    prov.PROV_REC_COMMUNICATION: ('wasInformedBy', ProvCommunication,
+        (prov.PROV_ATTR_INFORMED,), (prov.PROV_ATTR_INFORMANT,)),
+    prov.PROV_REC_START: ('wasStartedBy', ProvStart,
+        (prov.PROV_ATTR_ACTIVITY,), (prov.PROV_ATTR_STARTER, prov.PROV_ATTR_TRIGGER)),
+    prov.PROV_REC_END: ('wasEndedBy', ProvEnd,
+        (prov.PROV_ATTR_ACTIVITY,), (prov.PROV_ATTR_ENDER, prov.PROV_ATTR_TRIGGER)),
+    prov.PROV_REC_INVALIDATION: ('wasInvalidatedBy', ProvInvalidation,
+        (prov.PROV_ATTR_ACTIVITY,), (prov.PROV_ATTR_ENTITY,)),
+    prov.PROV_REC_DERIVATION: ('wasDerivedFrom', ProvDerivation,
+        (prov.PROV_ATTR_GENERATED_ENTITY,), (prov.PROV_ATTR_USED_ENTITY,)),
+    prov.PROV_REC_ATTRIBUTION: ('wasAttributedTo', ProvAttribution,
+        (prov.PROV_ATTR_ENTITY,), (prov.PROV_ATTR_AGENT,)),
+    prov.PROV_REC_ASSOCIATION: ('wasAssociatedWith', ProvAssociation,
+        (prov.PROV_ATTR_ACTIVITY,), (prov.PROV_ATTR_AGENT, prov.PROV_ATTR_PLAN)),
+    prov.PROV_REC_DELEGATION: ('actedOnBehalfOf', ProvDelegation,
+        (prov.PROV_ATTR_DELEGATE,), (prov.PROV_ATTR_RESPONSIBLE,)),
+    prov.PROV_REC_INFLUENCE: ('wasInfluencedBy', ProvInfluence,
+        (prov.PROV_ATTR_INFLUENCEE,), (prov.PROV_ATTR_INFLUENCER,)),
+    prov.PROV_REC_SPECIALIZATION: ('specializationOf', ProvSpecialization,
+        (prov.PROV_ATTR_SPECIFIC_ENTITY,), (prov.PROV_ATTR_GENERAL_ENTITY,)),
+    prov.PROV_REC_ALTERNATE: ('alternateOf', ProvAlternate,
+        (prov.PROV_ATTR_ALTERNATE1,), (prov.PROV_ATTR_ALTERNATE2,)),
+    prov.PROV_REC_MENTION: ('mentionOf', ProvMention,
+        (prov.PROV_ATTR_SPECIFIC_ENTITY,), (prov.PROV_ATTR_GENERAL_ENTITY,)),
+    prov.PROV_REC_MEMBERSHIP: ('hadMember', ProvMembership,
+        (prov.PROV_ATTR_COLLECTION,), (prov.PROV_ATTR_ENTITY,)),
+}
+
+# Properties that can be given to the model proxies when creating elements,
+# the others are set afterwards
+CREATE_PROPERTIES = ('identifier', 'digest', 'provn', 'asserted_types', 'attributes', 'extra_attributes')
+
+# extra attribute QName -> property key
+_extra_keys = {}
+
+PROV_TYPE = prov.PROV['type']
+
+_RECORD_TYPE_NAMES = dict(prov.PROV_RECORD_TYPES)
+
+
+class MissingEndpointError(ValueError):
+    """
+    a relation lacks one of the records it connects and cannot be drawn as an edge
+    """
+
+
+def property_value(value):
+    """
+    convert a PROV attribute value into a value that can be stored as a property
+    """
+    if isinstance(value, prov.ProvRecord):
+        identifier = value.get_identifier()
+        return identifier.get_uri() if identifier else None
+    elif isinstance(value, prov.Identifier):
+        return value.get_uri()
+    elif isinstance(value, prov.Literal):
+        return unicode(value.get_value())
+    elif isinstance(value, datetime.datetime):
+        return value.isoformat()
+    return value
+
+
+def extra_key(attribute):
+    """
+    property key of an extra attribute, e.g. prov_label for prov:label
+    """
+    try:
+        return _extra_keys[attribute]
+    except KeyError:
+        if isinstance(attribute, prov.QName):
+            key = attribute.get_namespace().get_prefix() + '_' + attribute.get_localpart()
+        else:
+            key = str(attribute)
+        _extra_keys[attribute] = key
+        return key
+
+
+class RecordMapper(object):
+    """
+    Precomputed translation of one PROV record type into model properties
+    """
+    def __init__(self, record_type, proxy, model, outV=None, inV=None):
+        self.record_type = record_type
+        self.proxy = proxy
+        self.model = model
+        self.outV = outV
+        self.inV = inV
+        self.is_element = outV is None
+        # vertices are indexed by element type, edges by label
+        self.index = model.element_type if self.is_element else model.label
+        self.prov_type = prov.PROV[_RECORD_TYPE_NAMES[record_type]].get_uri()
+        # PROV attribute id -> property key
+        self.keys = dict((prov.PROV_ATTRIBUTES_ID_MAP[attr], key)
+                         for attr, key in model.prov_attributes.items())
+
+    def properties(self, record):
+        """
+        flatten a record into the properties stored on its vertex or edge
+        """
+        attributes, extra_attributes = record.get_attributes()
+        identifier = record.get_identifier()
+        data = {
+            'identifier': identifier.get_uri() if identifier else 'rel',
+            'digest': record.get_digest(),
+            'provn': record.get_provn(),
+            'prov_type': self.prov_type,
+            'asserted_types': [],
+            'attributes': [],
+            'extra_attributes': [],
+        }
+        if self.is_element:
+            data['element_type'] = self.model.element_type
+        if attributes:
+            keys = self.keys
+            for attr, value in attributes.items():
+                if value is not None:
+                    key = keys[attr]
+                    data['attributes'].append(key)
+                    data[key] = property_value(value)
+        if extra_attributes:
+            for attr, value in extra_attributes:
+                key = extra_key(attr)
+                value = property_value(value)
+                if attr == PROV_TYPE:
+                    data['asserted_types'].append(value)
+                data['extra_attributes'].append(key)
+                data[key] = value
+        return data
+
+    def endpoints(self, record):
+        """
+        (outV, inV) records of a relation, None for elements
+
+        Raises MissingEndpointError for a relation without one of them.
+        """
+        if self.is_element:
+            return None
+        attributes = record.get_attributes()[0] or {}
+        outV = _first_present(attributes, self.outV)
+        inV = _first_present(attributes, self.inV)
+        if outV is None or inV is None:
+            missing = self.outV if outV is None else self.inV
+            raise MissingEndpointError('%s %s has no %s' % (
+                self.index, record.get_identifier() or record.get_digest(),
+                ' or '.join(prov.PROV_ID_ATTRIBUTES_MAP[attr] for attr in missing)))
+        return outV, inV
+
+
+def _first_present(attributes, candidates):
+    for attr in candidates:
+        value = attributes.get(attr)
+        if isinstance(value, prov.ProvRecord):
+            return value
+    return None
+
+
+MAPPERS = dict((record_type, RecordMapper(record_type, *mapping))
+               for record_type, mapping in RECORD_MAPPINGS.items())
@@ -0,0 +1,277 @@
+"""
+In-process stand-in for a Rexster graph
+
+Implements the parts of the bulbs Graph API used by Interface so that the
+ingest code can be exercised and profiled without a graph server. Every
+request can be delayed by a simulated round trip latency.
+
+Example:
+
+>>> from memory import MemoryGraph, Store
+>>> store = Store(latency=0.002)
+>>> interface = Interface(store, graph_class=MemoryGraph)
+>>> interface.process_bundle(bundle, batch_size=500)
+>>> len(store)
+"""
+__author__ = 'nolan'
+
+import itertools
+import threading
+import time
+
+from model import ProvRelation
+
+
+class Store(object):
+    """
+    The data of an in-memory graph
+
+    A Store takes the place of the Rexster Config: every MemoryGraph created
+    from the same store, e.g. by the sessions of an Interface, sees the same
+    vertices, edges and indices.
+    """
+    def __init__(self, latency=0.0):
+        # seconds slept for every request made to the graph
+        self.latency = latency
+        self.requests = 0
+        self._lock = threading.RLock()
+        self._eids = itertools.count(1)
+        # eid -> MemoryElement
+        self._elements = {}
+        # index name -> {(key, value) -> set of eids}, created by the proxies
+        self._indices = {}
+
+    def __len__(self):
+        return len(self._elements)
+
+    def request(self):
+        """
+        account for one round trip to the graph
+        """
+        with self._lock:
+            self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def add(self, index, data, label=None, outV=None, inV=None):
+        with self._lock:
+            element = MemoryElement(next(self._eids), index, data, label, outV, inV)
+            self._elements[element.eid] = element
+            self._index(element)
+            return element
+
+    def get(self, eid):
+        return self._elements.get(eid)
+
+    def create_index(self, index):
+        """
+        create a manual index, like the proxies of bulbs do with get_or_create
+        """
+        with self._lock:
+            self._indices.setdefault(index, {})
+
+    def has_index(self, index):
+        return index in self._indices
+
+    def update(self, eid, data):
+        """
+        replace the properties of an element, like a Rexster PUT
+        """
+        with self._lock:
+            element = self._elements[eid]
+            self._unindex(element)
+            element._data = dict(data)
+            self._index(element)
+            return element
+
+    def lookup(self, index, key, value):
+        with self._lock:
+            eids = self._indices.get(index, {}).get((key, _hashable(value)), ())
+            return [self._elements[eid] for eid in sorted(eids)]
+
+    def elements(self, index):
+        with self._lock:
+            return [element for element in self._elements.values() if element.index == index]
+
+    def _index(self, element):
+        entries = self._indices[element.index]
+        for key, value in element._data.items():
+            entries.setdefault((key, _hashable(value)), set()).add(element.eid)
+
+    def _unindex(self, element):
+        entries = self._indices.get(element.index, {})
+        for key, value in element._data.items():
+            entries.get((key, _hashable(value)), set()).discard(element.eid)
+
+
+def _hashable(value):
+    if isinstance(value, list):
+        return tuple(_hashable(item) for item in value)
+    if isinstance(value, dict):
+        return tuple(sorted((key, _hashable(item)) for key, item in value.items()))
+    return value
+
+
+class MemoryElement(object):
+    """
+    A vertex or an edge, with the eid / data() interface of bulbs elements
+    """
+    def __init__(self, eid, index, data, label=None, outV=None, inV=None):
+        self.eid = eid
+        self.index = index
+        self.label = label
+        self._outV = outV
+        self._inV = inV
+        self._data = dict(data)
+
+    def __getattr__(self, name):
+        try:
+            return self.__dict__['_data'][name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def __repr__(self):
+        return '<%s: %s>' % (self.label or self.index, self.eid)
+
+    def data(self):
+        return dict(self._data)
+
+
+class MemoryIndex(object):
+    def __init__(self, store, name):
+        self._store = store
+        self._name = name
+
+    def lookup(self, **properties):
+        """
+        elements whose property matches, as a generator, or None like bulbs
+        """
+        self._store.request()
+        (key, value), = properties.items()
+        elements = self._store.lookup(self._name, key, value)
+        return iter(elements) if elements else None
+
+
+class MemoryProxy(object):
+    """
+    Proxy of a model class, creating its vertices or edges
+    """
+    def __init__(self, store, model):
+        self._store = store
+        self._model = model
+        self._is_edge = issubclass(model, ProvRelation)
+        self._name = model.label if self._is_edge else model.element_type
+        store.create_index(self._name)
+        self.index = MemoryIndex(store, self._name)
+
+    def create(self, *args, **properties):
+        if self._is_edge:
+            outV, inV = args[:2]
+            args = args[2:]
+        else:
+            outV = inV = None
+        data = dict(args[0]) if args else {}
+        data.update(properties)
+        self._store.request()
+        label = self._name if self._is_edge else None
+        return self._store.add(self._name, data, label, _eid(outV), _eid(inV))
+
+    def get(self, eid):
+        self._store.request()
+        return self._store.get(eid)
+
+    def get_all(self):
+        self._store.request()
+        return iter(self._store.elements(self._name))
+
+    def get_property_keys(self):
+        return sorted(set(key for element in self._store.elements(self._name) for key in element._data))
+
+
+def _eid(element):
+    return getattr(element, 'eid', element)
+
+
+class MemoryElements(object):
+    """
+    graph.vertices and graph.edges
+    """
+    def __init__(self, store):
+        self._store = store
+
+    def get(self, eid):
+        self._store.request()
+        return self._store.get(eid)
+
+    def update(self, eid, data):
+        self._store.request()
+        return self._store.update(eid, data)
+
+
+class MemoryGremlin(object):
+    """
+    Runs the Gremlin scripts of interface.py natively
+
+    Scripts are recognised by their parameters: vertices / edges / known for
+    BATCH_SCRIPT and lookups for SYNC_SCRIPT. Like g.idx() on Rexster, the
+    scripts fail on an index that was never created by a proxy.
+    """
+    def __init__(self, store):
+        self._store = store
+
+    def execute(self, script, params=None):
+        params = params or {}
+        self._store.request()
+        if 'lookups' in params:
+            results = self._sync(params['lookups'])
+        elif 'vertices' in params and 'edges' in params:
+            results = self._batch(params['vertices'], params['edges'], params.get('known', {}))
+        else:
+            raise NotImplementedError('MemoryGraph cannot run this Gremlin script')
+        return MemoryResponse(results)
+
+    def _index(self, name):
+        if not self._store.has_index(name):
+            raise SystemError('Gremlin script failed: index %s does not exist' % name)
+
+    def _batch(self, vertices, edges, known):
+        store = self._store
+        for index in set([vertex['index'] for vertex in vertices] + [edge['label'] for edge in edges]):
+            self._index(index)
+        eids = dict(known)
+        for vertex in vertices:
+            eids[vertex['key']] = store.add(vertex['index'], vertex['data']).eid
+        for edge in edges:
+            eids[edge['key']] = store.add(edge['label'], edge['data'], edge['label'],
+                                          eids[edge['outV']], eids[edge['inV']]).eid
+        return eids
+
+    def _sync(self, lookups):
+        found = {}
+        for lookup in lookups:
+            self._index(lookup['index'])
+            elements = self._store.lookup(lookup['index'], lookup['property'], lookup['value'])
+            occurrence = lookup.get('occurrence', 0)
+            if len(elements) > occurrence:
+                element = elements[occurrence]
+                found[lookup['key']] = [element.eid, element._data.get('digest')]
+        return found
+
+
+class MemoryResponse(object):
+    def __init__(self, result):
+        self.content = {'results': [result]}
+
+
+class MemoryGraph(object):
+    """
+    Connection to a Store with the API of bulbs.rexster.Graph used by Interface
+    """
+    def __init__(self, config):
+        self.config = config
+        self.vertices = MemoryElements(config)
+        self.edges = MemoryElements(config)
+        self.gremlin = MemoryGremlin(config)
+
+    def add_proxy(self, proxy_name, element_class):
+        setattr(self, proxy_name, MemoryProxy(self.config, element_class))
@@ -19,11 +19,15 @@ class ProvElement(Node):
     """
     element_type = 'element'
 
+    # PROV attribute -> property, see provbulbs.mapper
+    prov_attributes = {}
+
     # Required
     identifier = String(nullable=False)
     created = DateTime(default=current_datetime, nullable=False)
 
     # Optional
+    digest = String(nullable=True)
     asserted_types = List(nullable=True)
     attributes = List(nullable=True)
     provn = String(nullable=True)
@@ -35,11 +39,15 @@ class ProvRelation(Relationship):
 
     label = "relation"
 
+    # PROV attribute -> property, see provbulbs.mapper
+    prov_attributes = {}
+
     # Required
     identifier = String(default=lambda :str("rel"), nullable=False)
     created = DateTime(default=current_datetime, nullable=False)
 
     # Optional
+    digest = String(nullable=True)
     asserted_types = List(nullable=True)
     attributes = List(nullable=True)
     provn = String(nullable=True)
@@ -71,6 +79,7 @@ class ProvActivity(ProvElement):
     """
     element_type = "activity"
     prov_type = String(default=lambda:"http://www.w3.org/ns/prov#Activity",nullable=False)
+    prov_attributes = {'prov:startTime': 'start_time', 'prov:endTime': 'end_time'}
 
     # Optional
     start_time = DateTime(nullable=True)
@@ -82,6 +91,7 @@ class ProvGeneration(ProvRelation):
     """
     label = "wasGeneratedBy"
     prov_type = String(default=lambda:"http://www.w3.org/ns/prov#Generation",nullable=False)
+    prov_attributes = {'prov:entity': 'entity', 'prov:activity': 'activity', 'prov:time': 'time'}
     # Required attributes
     entity = String(nullable=False)
     # Optional attributes
@@ -94,6 +104,7 @@ class ProvUsage(ProvRelation):
     """
     label = "used"
     prov_type = String(default=lambda:"http://www.w3.org/ns/prov#Usage",nullable=False)
+    prov_attributes = {'prov:activity': 'activity', 'prov:entity': 'entity', 'prov:time': 'time'}
     # Required attributes
     activity = String(nullable=False)
     # Optional attributes
@@ -106,6 +117,7 @@ class ProvCommunication(ProvRelation):
     """
     label = "wasInformedBy"
     prov_type = String(default=lambda:"http://www.w3.org/ns/prov#Communication",nullable=False)
+    prov_attributes = {'prov:informed': 'informed_activity', 'prov:informant': 'informant_activity'}
     # Required attributes
     informed_activity = String(nullable=False)
     informant_activity = String(nullable=False)
@@ -116,6 +128,8 @@ class ProvStart(ProvRelation):
     """
     label = "wasStartedBy"
     prov_type = String(default=lambda:"http://www.w3.org/ns/prov#Start",nullable=False)
+    prov_attributes = {'prov:activity': 'activity', 'prov:trigger': 'trigger_entity',
+                       'prov:starter': 'starter_activity', 'prov:time': 'time'}
     # Required attributes
     activity = String(nullable=False)
     # Optional attributes
@@ -129,6 +143,8 @@ class ProvEnd(ProvRelation):
     """
     label = "wasEndedBy"
     prov_type = String(default=lambda:"http://www.w3.org/ns/prov#End",nullable=False)
+    prov_attributes = {'prov:activity': 'activity', 'prov:trigger': 'trigger_entity',
+                       'prov:ender': 'ender_activity', 'prov:time': 'time'}
     # Required attributes
     activity = String(nullable=False)
     # Optional attributes
@@ -142,6 +158,7 @@ class ProvInvalidation(ProvRelation):
     """
     label = "wasInvalidatedBy"
     prov_type = String(default=lambda:"http://www.w3.org/ns/prov#Invalidation",nullable=False)
+    prov_attributes = {'prov:entity': 'entity', 'prov:activity': 'activity', 'prov:time': 'time'}
     # Required attributes
     entity = String(nullable=False)
     # Optional attributes
@@ -156,6 +173,8 @@ class ProvDerivation(ProvRelation):
     """
     label = "wasDerivedFrom"
     prov_type = String(default=lambda:"http://www.w3.org/ns/prov#Derivation",nullable=False)
+    prov_attributes = {'prov:generatedEntity': 'generated_entity', 'prov:usedEntity': 'used_entity',
+                       'prov:activity': 'activity', 'prov:generation': 'generation', 'prov:usage': 'usage'}
     # Required attributes
     generated_entity = String(nullable=False)
     used_entity = String(nullable=False)
@@ -179,6 +198,7 @@ class ProvAttribution(ProvRelation):
     """
     label = "wasAttributedTo"
     prov_type = String(default=lambda:"http://www.w3.org/ns/prov#Attribution",nullable=False)
+    prov_attributes = {'prov:entity': 'entity', 'prov:agent': 'agent'}
     # Required attributes
     entity = String(nullable=False)
     agent = String(nullable=False)
@@ -189,6 +209,7 @@ class ProvAssociation(ProvRelation):
     """
     label = "wasAssociatedWith"
     prov_type = String(default=lambda:"http://www.w3.org/ns/prov#Association",nullable=False)
+    prov_attributes = {'prov:activity': 'activity', 'prov:agent': 'agent', 'prov:plan': 'plan'}
     # Required attributes
     activity = String(nullable=False)
     # Optional attributes
@@ -199,8 +220,10 @@ class ProvDelegation(ProvRelation):
     """
     prov:delegation
     """
-    label = "wasAssociatedWith"
+    label = "actedOnBehalfOf"
     prov_type = String(default=lambda:"http://www.w3.org/ns/prov#Delegation",nullable=False)
+    prov_attributes = {'prov:delegate': 'delegate_entity', 'prov:responsible': 'responsible_entity',
+                       'prov:activity': 'activity'}
     # Required attributes
     delegate_entity = String(nullable=False)
     responsible_entity = String(nullable=False)
@@ -213,6 +236,8 @@ class ProvInfluence(ProvRelation):
     """
     label = "wasInfluencedBy"
     prov_type = String(default=lambda:"http://www.w3.org/ns/prov#Influence",nullable=False)
+    prov_attributes = {'prov:influencee': 'influencee_entity', 'prov:influencer': 'influencer_entity',
+                       'prov:activity': 'activity'}
     # Required attributes
     influencee_entity = String(nullable=False)
     influencer_entity = String(nullable=False)
@@ -231,6 +256,7 @@ class ProvSpecialization(ProvRelation):
     """
     label = "specializationOf"
     prov_type = String(default=lambda:"http://www.w3.org/ns/prov#Specialization",nullable=False)
+    prov_attributes = {'prov:specificEntity': 'specific_entity', 'prov:generalEntity': 'general_entity'}
     # Required attributes
     specific_entity = String(nullable=False)
     general_entity = String(nullable=False)
@@ -241,6 +267,7 @@ class ProvAlternate(ProvRelation):
     """
     label = "alternateOf"
     prov_type = String(default=lambda:"http://www.w3.org/ns/prov#Alternate",nullable=False)
+    prov_attributes = {'prov:alternate1': 'alternate1_entity', 'prov:alternate2': 'alternate2_entity'}
     # Required attributes
     alternate1_entity = String(nullable=False)
     alternate2_entity = String(nullable=False)
@@ -251,6 +278,8 @@ class ProvMention(ProvSpecialization):
     """
     label = "mentionOf"
     #prov_type = "http://www.w3.org/ns/prov#Mention"
+    prov_attributes = {'prov:specificEntity': 'specific_entity', 'prov:generalEntity': 'general_entity',
+                       'prov:bundle': 'bundle_entity'}
     # Required attributes
     collection = String(nullable=False)
     bundle_entity = String(nullable=False)
@@ -263,8 +292,9 @@ class ProvMembership(ProvRelation):
     """
     label = "hadMember"
     prov_type = String(default=lambda:"http://www.w3.org/ns/prov#Membership",nullable=False)
+    prov_attributes = {'prov:collection': 'collection_entity', 'prov:entity': 'entity'}
     # Required attributes
-    colection_entity = String(nullable=False)
+    collection_entity = String(nullable=False)
     entity = String(nullable=False)
 
 class ProvBundle(ProvEntity):
@@ -12,10 +12,14 @@ PROV-DM: http://www.w3.org/TR/prov-dm/
 
 import logging
 import datetime
+import hashlib
 import json
 import re
+import bisect
 import collections
-from collections import OrderedDict, defaultdict
+import importlib
+import weakref
+from collections import defaultdict
 logger = logging.getLogger(__name__)
 
 ## PROV record constants - PROV-DM LC
@@ -62,6 +66,7 @@ PROV_RECORD_TYPES = (
     (PROV_REC_ATTRIBUTION,          u'Attribution'),
     (PROV_REC_ASSOCIATION,          u'Association'),
     (PROV_REC_DELEGATION,           u'Delegation'),
+    (PROV_REC_INFLUENCE,            u'Influence'),
     (PROV_REC_BUNDLE,               u'Bundle'),
     (PROV_REC_ALTERNATE,            u'Alternate'),
     (PROV_REC_SPECIALIZATION,       u'Specialization'),
@@ -71,6 +76,10 @@ PROV_RECORD_TYPES = (
     (PROV_REC_BUNDLE,               u'Bundle'),
     )
 
+# Record types of the elements and of the relations
+PROV_ELEMENT_TYPES = (PROV_REC_ENTITY, PROV_REC_ACTIVITY, PROV_REC_AGENT, PROV_REC_BUNDLE)
+PROV_RELATION_TYPES = tuple(rec_type for rec_type, name in PROV_RECORD_TYPES if rec_type not in PROV_ELEMENT_TYPES)
+
 PROV_N_MAP = {
     PROV_REC_ENTITY:               u'entity',
     PROV_REC_ACTIVITY:             u'activity',
@@ -88,6 +97,7 @@ PROV_N_MAP = {
     PROV_REC_ALTERNATE:            u'alternateOf',
     PROV_REC_SPECIALIZATION:       u'specializationOf',
     PROV_REC_MENTION:              u'mentionOf',
+    PROV_REC_INFLUENCE:            u'wasInfluencedBy',
     #    PROV_REC_COLLECTION:           u'Collection',
     PROV_REC_MEMBERSHIP:           u'memberOf',
     PROV_REC_BUNDLE:               u'bundle',
@@ -147,6 +157,7 @@ PROV_RECORD_ATTRIBUTES = (
     (PROV_ATTR_BUNDLE, u'prov:bundle'),
     (PROV_ATTR_INFLUENCEE, u'prov:influencee'),
     (PROV_ATTR_INFLUENCER, u'prov:influencer'),
+    (PROV_ATTR_COLLECTION, u'prov:collection'),
     # Literal properties
     (PROV_ATTR_TIME, u'prov:time'),
     (PROV_ATTR_STARTTIME, u'prov:startTime'),
@@ -159,6 +170,26 @@ PROV_RECORD_IDS_MAP = dict((PROV_N_MAP[rec_type_id], rec_type_id) for rec_type_i
 PROV_ID_ATTRIBUTES_MAP = dict((prov_id, attribute) for (prov_id, attribute) in PROV_RECORD_ATTRIBUTES)
 PROV_ATTRIBUTES_ID_MAP = dict((attribute, prov_id) for (prov_id, attribute) in PROV_RECORD_ATTRIBUTES)
 
+# Lineage of the relations: record type -> (subject attribute, attributes of
+# the elements the subject depends on), see ProvBundle.ancestors
+PROV_LINEAGE_ATTRIBUTES = {
+    PROV_REC_GENERATION:        (PROV_ATTR_ENTITY, (PROV_ATTR_ACTIVITY,)),
+    PROV_REC_USAGE:             (PROV_ATTR_ACTIVITY, (PROV_ATTR_ENTITY,)),
+    PROV_REC_COMMUNICATION:     (PROV_ATTR_INFORMED, (PROV_ATTR_INFORMANT,)),
+    PROV_REC_START:             (PROV_ATTR_ACTIVITY, (PROV_ATTR_TRIGGER, PROV_ATTR_STARTER)),
+    PROV_REC_END:               (PROV_ATTR_ACTIVITY, (PROV_ATTR_TRIGGER, PROV_ATTR_ENDER)),
+    PROV_REC_INVALIDATION:      (PROV_ATTR_ENTITY, (PROV_ATTR_ACTIVITY,)),
+    PROV_REC_DERIVATION:        (PROV_ATTR_GENERATED_ENTITY, (PROV_ATTR_USED_ENTITY, PROV_ATTR_ACTIVITY)),
+    PROV_REC_ATTRIBUTION:       (PROV_ATTR_ENTITY, (PROV_ATTR_AGENT,)),
+    PROV_REC_ASSOCIATION:       (PROV_ATTR_ACTIVITY, (PROV_ATTR_AGENT, PROV_ATTR_PLAN)),
+    PROV_REC_DELEGATION:        (PROV_ATTR_DELEGATE, (PROV_ATTR_RESPONSIBLE, PROV_ATTR_ACTIVITY)),
+    PROV_REC_INFLUENCE:         (PROV_ATTR_INFLUENCEE, (PROV_ATTR_INFLUENCER,)),
+    PROV_REC_SPECIALIZATION:    (PROV_ATTR_SPECIFIC_ENTITY, (PROV_ATTR_GENERAL_ENTITY,)),
+    PROV_REC_ALTERNATE:         (PROV_ATTR_ALTERNATE1, (PROV_ATTR_ALTERNATE2,)),
+    PROV_REC_MENTION:           (PROV_ATTR_SPECIFIC_ENTITY, (PROV_ATTR_GENERAL_ENTITY, PROV_ATTR_BUNDLE)),
+    PROV_REC_MEMBERSHIP:        (PROV_ATTR_COLLECTION, (PROV_ATTR_ENTITY,)),
+    }
+
 _r_xsd_dateTime = re.compile(""" ^
     (?P<year>-?[0-9]{4}) - (?P<month>[0-9]{2}) - (?P<day>[0-9]{2})
     T (?P<hour>[0-9]{2}) : (?P<minute>[0-9]{2}) : (?P<second>[0-9]{2})
@@ -173,9 +204,18 @@ _r_typed_literal_qname = re.compile(r'^"(?P<value>[^"\\]*(?:\\.[^"\\]*)*)"\^\^(?
 # Datatypes
 def _parse_xsd_dateTime(s):
     """Returns datetime or None."""
+    # fast path for the usual YYYY-MM-DDThh:mm:ss[.ffffff] form
+    if len(s) in (19, 26) and s[10] == 'T' and s[4] == s[7] == '-' and s[13] == s[16] == ':' \
+            and (len(s) == 19 or s[19] == '.'):
+        try:
+            return datetime.datetime(int(s[0:4]), int(s[5:7]), int(s[8:10]), int(s[11:13]), int(s[14:16]),
+                                     int(s[17:19]), int(s[20:26]) if len(s) == 26 else 0)
+        except ValueError:
+            pass
     m = _r_xsd_dateTime.match(s)
-    if m is not None:
-        values = m.groupdict()
+    if m is None:
+        return None
+    values = m.groupdict()
     if values["microsecond"] is None:
         values["microsecond"] = 0
     else:
@@ -212,6 +252,8 @@ def parse_datatype(value, datatype):
         raise Exception(u'No parser found for the data type <%s>' % str(datatype))
 
 class Literal(object):
+    __slots__ = ('_value', '_datatype')
+
     def __init__(self, value, datatype):
         self._value = value
         self._datatype = datatype
@@ -235,9 +277,43 @@ class Literal(object):
             # Assuming it is a valid identifier
             return u'"%s"^^<%s>' % (str(self._value), self._datatype.get_uri())
 
+# Interned identifiers: URI, or (prefix, namespace URI, local part) for
+# qualified names -> weak reference to the identifier. Entries are removed
+# when their identifier is no longer in use.
+_identifiers = {}
+
+def _forget_identifier(ref):
+    if _identifiers.get(ref.key) is ref:
+        del _identifiers[ref.key]
+
+def _intern(identifier, key):
+    _identifiers[key] = weakref.KeyedRef(identifier, _forget_identifier, key)
+    return identifier
+
+
 class Identifier(object):
-    def __init__(self, uri):
-        self._uri = uri
+    """An URI identifier.
+
+    Identifiers are interned: creating an identifier with the URI of one that
+    exists returns the existing object, and the URI and its hash are computed
+    once, so identifiers compare and hash at the cost of a pointer check.
+    """
+    __slots__ = ('_uri', '_hash', '__weakref__')
+
+    def __new__(cls, uri):
+        ref = _identifiers.get(uri)
+        if ref is not None:
+            identifier = ref()
+            if identifier is not None:
+                return identifier
+        identifier = object.__new__(cls)
+        identifier._uri = uri
+        identifier._hash = hash(uri)
+        return _intern(identifier, uri)
+
+    def __reduce__(self):
+        # unpickled identifiers are interned too
+        return Identifier, (self._uri,)
 
     def get_uri(self):
         return self._uri
@@ -246,10 +322,10 @@ class Identifier(object):
         return self._uri
 
     def __eq__(self, other):
-        return self.get_uri() == other.get_uri() if isinstance(other, Identifier) else False
+        return self is other or (isinstance(other, Identifier) and self._uri == other._uri)
 
     def __hash__(self):
-        return hash(self.get_uri())
+        return self._hash
 
     def provn_representation(self):
         return self._uri + u' %% xsd:anyURI'
@@ -259,10 +335,25 @@ class Identifier(object):
 
 
 class QName(Identifier):
-    def __init__(self, namespace, localpart):
-        self._namespace = namespace
-        self._localpart = localpart
-        self._str = ':'.join([namespace._prefix, localpart]) if namespace._prefix else localpart
+    __slots__ = ('_namespace', '_localpart', '_str')
+
+    def __new__(cls, namespace, localpart):
+        key = (namespace._prefix, namespace._uri, localpart)
+        ref = _identifiers.get(key)
+        if ref is not None:
+            qname = ref()
+            if qname is not None:
+                return qname
+        qname = object.__new__(cls)
+        qname._namespace = namespace
+        qname._localpart = localpart
+        qname._str = ':'.join([namespace._prefix, localpart]) if namespace._prefix else localpart
+        qname._uri = namespace._uri + localpart
+        qname._hash = hash(qname._uri)
+        return _intern(qname, key)
+
+    def __reduce__(self):
+        return QName, (self._namespace, self._localpart)
 
     def get_namespace(self):
         return self._namespace
@@ -270,9 +361,6 @@ class QName(Identifier):
     def get_localpart(self):
         return self._localpart
 
-    def get_uri(self):
-        return ''.join([self._namespace._uri, self._localpart])
-
     def __str__(self):
         return self._str
 
@@ -284,11 +372,17 @@ class QName(Identifier):
 
 
 class Namespace(object):
+    __slots__ = ('_prefix', '_uri', '_cache')
+
     def __init__(self, prefix, uri):
         self._prefix = prefix
         self._uri = uri
         self._cache = dict()
 
+    def __reduce__(self):
+        # the qualified names are interned, the cache is rebuilt on use
+        return Namespace, (self._prefix, self._uri)
+
     def get_prefix(self):
         return self._prefix
 
@@ -309,6 +403,9 @@ class Namespace(object):
     def __eq__(self, other):
         return (self._uri == other._uri and self._prefix == other._prefix) if isinstance(other, Namespace) else False
 
+    def __hash__(self):
+        return hash((self._prefix, self._uri))
+
     def __getitem__(self, localpart):
         if localpart in self._cache:
             return self._cache[localpart]
@@ -322,6 +419,24 @@ PROV = Namespace("prov",'http://www.w3.org/ns/prov#')
 
 ### Exceptions
 
+# JSON module parsing PROV-JSON documents, see use_json_backend
+_json_backend = None
+
+def use_json_backend(module=None):
+    """Parses PROV-JSON documents with another JSON module, e.g. 'ujson' or 'simplejson'.
+
+    module is a module, or the name of one, with a loads function returning
+    the parsed document. ProvBundle.JSONDecoder then only parses with it and
+    decodes the PROV records itself. Pass None to go back to the json module.
+    load_stream always uses the json module.
+    """
+    global _json_backend
+    if isinstance(module, basestring):
+        module = importlib.import_module(module)
+    _json_backend = module
+    return module
+
+
 class ProvException(Exception):
     """Base class for exceptions in this module."""
     pass
@@ -345,14 +460,106 @@ class ProvExceptionContraint(ProvException):
         self.msg = msg
 
 
+def _digest_representation(value):
+    """Returns the canonical text of an attribute value used in record digests."""
+    if isinstance(value, ProvRecord):
+        identifier = value.get_identifier()
+        return identifier.get_uri() if identifier else value.get_digest()
+    elif isinstance(value, Identifier):
+        return u'<%s>' % value.get_uri()
+    elif isinstance(value, Literal):
+        return u'"%s"^^%s' % (value.get_value(), _digest_representation(value.get_datatype()))
+    elif isinstance(value, datetime.datetime):
+        return u'"%s"^^xsd:dateTime' % value.isoformat()
+    else:
+        return u'"%s"' % value
+
+class AttributeLayout(object):
+    """The PROV attributes of a record type, in the order they are stored and listed."""
+    __slots__ = ('ids', 'index')
+
+    def __init__(self, *ids):
+        self.ids = ids
+        self.index = dict((attr, position) for position, attr in enumerate(ids))
+
+
+class RecordAttributes(object):
+    """Fixed-position mapping of PROV attribute ids to values.
+
+    The attribute ids are kept once per record type in an AttributeLayout,
+    every record only stores the list of its values. Provides the mapping API
+    of an OrderedDict, in layout order.
+    """
+    __slots__ = ('_layout', '_values')
+
+    def __init__(self, layout, values):
+        self._layout = layout
+        self._values = values
+
+    def __len__(self):
+        return len(self._values)
+
+    def __iter__(self):
+        return iter(self._layout.ids)
+
+    def __contains__(self, attr):
+        return attr in self._layout.index
+
+    def __getitem__(self, attr):
+        return self._values[self._layout.index[attr]]
+
+    def __setitem__(self, attr, value):
+        try:
+            self._values[self._layout.index[attr]] = value
+        except KeyError:
+            raise KeyError(u'%s is not an attribute of this record type' % PROV_ID_ATTRIBUTES_MAP.get(attr, attr))
+
+    def __eq__(self, other):
+        try:
+            return self.items() == other.items()
+        except AttributeError:
+            return False
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return 'RecordAttributes(%r)' % self.items()
+
+    def get(self, attr, default=None):
+        position = self._layout.index.get(attr)
+        return default if position is None else self._values[position]
+
+    def keys(self):
+        return list(self._layout.ids)
+
+    def values(self):
+        return list(self._values)
+
+    def items(self):
+        return zip(self._layout.ids, self._values)
+
+    def iteritems(self):
+        return iter(self.items())
+
+    def update(self, attributes):
+        for attr, value in attributes.items():
+            self[attr] = value
+
+
 # PROV records
 class ProvRecord(object):
     """Base class for PROV _records."""
+    __slots__ = ('_bundle', '_identifier', '_attributes', '_extra_attributes', '_provn', '_digest')
+
     def __init__(self, bundle, identifier, attributes=None, other_attributes=None):
         self._bundle = bundle
         self._identifier = identifier
         self._attributes = None
         self._extra_attributes = None
+        # PROV-N representation and digest, see get_provn and get_digest
+        self._provn = None
+        self._digest = None
         if attributes or other_attributes:
             self.add_attributes(attributes, other_attributes)
 
@@ -374,6 +581,7 @@ class ProvRecord(object):
             if self._extra_attributes is None:
                 self._extra_attributes = []
             self._extra_attributes.append((PROV['type'], type_identifier))
+            self._changed()
 
     def get_identifier(self):
         return self._identifier
@@ -392,6 +600,7 @@ class ProvRecord(object):
             attr_list = ((self._bundle.valid_identifier(attribute), value) for attribute, value in extra_attributes)
             # Check attributes for valid qualified names
             self._extra_attributes.extend(attr_list)
+            self._changed()
 
     def add_attributes(self, attributes, extra_attributes):
         if attributes:
@@ -399,14 +608,46 @@ class ProvRecord(object):
                 self._attributes = attributes
             else:
                 self._attributes.update(attributes)
+            self._changed()
         self.add_extra_attributes(extra_attributes)
 
     def get_attributes(self):
         return (self._attributes, self._extra_attributes)
 
+    def _changed(self):
+        # drop what has been computed from the content of the record,
+        # and the digest of the bundles containing it
+        self._provn = None
+        self._digest = None
+        bundle = self._bundle
+        while bundle is not None and bundle._digest is not None:
+            bundle._digest = None
+            bundle = bundle._bundle
+
     def get_bundle(self):
         return self._bundle
 
+    def get_digest(self):
+        """Returns a SHA-1 hex digest of the record's type, identifier and attributes.
+
+        The digest only depends on the content of the record, records that refer to
+        each other are represented by their identifiers, and extra attributes are
+        sorted, so it is stable across runs and serialisations. It is kept until
+        the record's attributes change, like the PROV-N of get_provn.
+        """
+        if self._digest is None:
+            items = [PROV_N_MAP[self.get_type()], self._identifier.get_uri() if self._identifier else None]
+            # a record without attributes and one whose attributes are all unset are the same
+            attributes = sorted((attr, _digest_representation(value))
+                for attr, value in (self._attributes.items() if self._attributes else ()) if value is not None)
+            if attributes:
+                items.append(attributes)
+            if self._extra_attributes:
+                items.append(sorted((_digest_representation(attr), _digest_representation(value))
+                    for attr, value in self._extra_attributes))
+            self._digest = hashlib.sha1(json.dumps(items)).hexdigest()
+        return self._digest
+
     def _parse_identifier(self, value):
         try:
             return value.get_identifier()
@@ -505,6 +746,17 @@ class ProvRecord(object):
         return self.get_provn()
 
     def get_provn(self, _indent_level=0):
+        """Returns the PROV-N representation of the record.
+
+        It is computed once and kept until the record's attributes change
+        through add_attributes, add_extra_attributes, add_asserted_type or
+        set_time.
+        """
+        if self._provn is None:
+            self._provn = self._encode_provn()
+        return self._provn
+
+    def _encode_provn(self):
         items = []
         if self._identifier:
             items.append(str(self._identifier))
@@ -543,10 +795,22 @@ class ProvRecord(object):
         return False
 
 class ProvElement(ProvRecord):
+    __slots__ = ()
+
     def is_element(self):
         return True
 
 class ProvRelation(ProvRecord):
+    __slots__ = ()
+
+    def add_attributes(self, attributes, extra_attributes):
+        # keep the adjacency index of the bundle up to date
+        if attributes and self._attributes:
+            self._bundle._unindex_relation(self)
+        ProvRecord.add_attributes(self, attributes, extra_attributes)
+        if attributes:
+            self._bundle._index_relation(self)
+
     def is_relation(self):
         return True
 
@@ -554,6 +818,8 @@ class ProvRelation(ProvRecord):
 ### Component 1: Entities and Activities
 
 class ProvEntity(ProvElement):
+    __slots__ = ()
+
     def get_type(self):
         return PROV_REC_ENTITY
 
@@ -562,6 +828,9 @@ class ProvEntity(ProvElement):
 
 
 class ProvActivity(ProvElement):
+    __slots__ = ()
+    _attribute_layout = AttributeLayout(PROV_ATTR_STARTTIME, PROV_ATTR_ENDTIME)
+
     def get_type(self):
         return PROV_REC_ACTIVITY
 
@@ -574,9 +843,7 @@ class ProvActivity(ProvElement):
         if startTime and endTime and startTime > endTime:
             #TODO Raise logic exception here
             pass
-        attributes = OrderedDict()
-        attributes[PROV_ATTR_STARTTIME] = startTime
-        attributes[PROV_ATTR_ENDTIME] = endTime
+        attributes = RecordAttributes(self._attribute_layout, [startTime, endTime])
 
         ProvElement.add_attributes(self, attributes, extra_attributes)
 
@@ -585,8 +852,12 @@ class ProvActivity(ProvElement):
         # The _attributes dict should be initialised
         self._attributes[PROV_ATTR_STARTTIME] = startTime
         self._attributes[PROV_ATTR_ENDTIME] = endTime
+        self._changed()
 
 class ProvGeneration(ProvRelation):
+    __slots__ = ()
+    _attribute_layout = AttributeLayout(PROV_ATTR_ENTITY, PROV_ATTR_ACTIVITY, PROV_ATTR_TIME)
+
     def get_type(self):
         return PROV_REC_GENERATION
 
@@ -600,15 +871,15 @@ class ProvGeneration(ProvRelation):
         activity = self.optional_attribute(attributes, PROV_ATTR_ACTIVITY, ProvActivity)
         time = self.optional_attribute(attributes, PROV_ATTR_TIME, datetime.datetime)
 
-        attributes = OrderedDict()
-        attributes[PROV_ATTR_ENTITY] = entity
-        attributes[PROV_ATTR_ACTIVITY] = activity
-        attributes[PROV_ATTR_TIME] = time
+        attributes = RecordAttributes(self._attribute_layout, [entity, activity, time])
 
         ProvRelation.add_attributes(self, attributes, extra_attributes)
 
 
 class ProvUsage(ProvRelation):
+    __slots__ = ()
+    _attribute_layout = AttributeLayout(PROV_ATTR_ACTIVITY, PROV_ATTR_ENTITY, PROV_ATTR_TIME)
+
     def get_type(self):
         return PROV_REC_USAGE
 
@@ -622,13 +893,13 @@ class ProvUsage(ProvRelation):
         entity = self.optional_attribute(attributes, PROV_ATTR_ENTITY, ProvEntity)
         time = self.optional_attribute(attributes, PROV_ATTR_TIME, datetime.datetime)
 
-        attributes = OrderedDict()
-        attributes[PROV_ATTR_ACTIVITY] = activity
-        attributes[PROV_ATTR_ENTITY] = entity
-        attributes[PROV_ATTR_TIME] = time
+        attributes = RecordAttributes(self._attribute_layout, [activity, entity, time])
         ProvRelation.add_attributes(self, attributes, extra_attributes)
 
 class ProvCommunication(ProvRelation):
+    __slots__ = ()
+    _attribute_layout = AttributeLayout(PROV_ATTR_INFORMED, PROV_ATTR_INFORMANT)
+
     def get_type(self):
         return PROV_REC_COMMUNICATION
 
@@ -640,12 +911,13 @@ class ProvCommunication(ProvRelation):
         informed = self.required_attribute(attributes, PROV_ATTR_INFORMED, ProvActivity)
         informant = self.required_attribute(attributes, PROV_ATTR_INFORMANT, ProvActivity)
 
-        attributes = OrderedDict()
-        attributes[PROV_ATTR_INFORMED] = informed
-        attributes[PROV_ATTR_INFORMANT] = informant
+        attributes = RecordAttributes(self._attribute_layout, [informed, informant])
         ProvRelation.add_attributes(self, attributes, extra_attributes)
 
 class ProvStart(ProvRelation):
+    __slots__ = ()
+    _attribute_layout = AttributeLayout(PROV_ATTR_ACTIVITY, PROV_ATTR_TRIGGER, PROV_ATTR_STARTER, PROV_ATTR_TIME)
+
     def get_type(self):
         return PROV_REC_START
 
@@ -660,14 +932,13 @@ class ProvStart(ProvRelation):
         starter = self.optional_attribute(attributes, PROV_ATTR_STARTER, ProvActivity)
         time = self.optional_attribute(attributes, PROV_ATTR_TIME, datetime.datetime)
 
-        attributes = OrderedDict()
-        attributes[PROV_ATTR_ACTIVITY] = activity
-        attributes[PROV_ATTR_TRIGGER] = trigger
-        attributes[PROV_ATTR_STARTER] = starter
-        attributes[PROV_ATTR_TIME] = time
+        attributes = RecordAttributes(self._attribute_layout, [activity, trigger, starter, time])
         ProvRelation.add_attributes(self, attributes, extra_attributes)
 
 class ProvEnd(ProvRelation):
+    __slots__ = ()
+    _attribute_layout = AttributeLayout(PROV_ATTR_ACTIVITY, PROV_ATTR_TRIGGER, PROV_ATTR_ENDER, PROV_ATTR_TIME)
+
     def get_type(self):
         return PROV_REC_END
 
@@ -682,15 +953,14 @@ class ProvEnd(ProvRelation):
         ender = self.optional_attribute(attributes, PROV_ATTR_ENDER, ProvActivity)
         time = self.optional_attribute(attributes, PROV_ATTR_TIME, datetime.datetime)
 
-        attributes = OrderedDict()
-        attributes[PROV_ATTR_ACTIVITY] = activity
-        attributes[PROV_ATTR_TRIGGER] = trigger
-        attributes[PROV_ATTR_ENDER] = ender
-        attributes[PROV_ATTR_TIME] = time
+        attributes = RecordAttributes(self._attribute_layout, [activity, trigger, ender, time])
         ProvRelation.add_attributes(self, attributes, extra_attributes)
 
 
 class ProvInvalidation(ProvRelation):
+    __slots__ = ()
+    _attribute_layout = AttributeLayout(PROV_ATTR_ENTITY, PROV_ATTR_ACTIVITY, PROV_ATTR_TIME)
+
     def get_type(self):
         return PROV_REC_INVALIDATION
 
@@ -707,16 +977,16 @@ class ProvInvalidation(ProvRelation):
         if (activity is None) and (time is None) and (not extra_attributes):
             raise ProvException(u'At least one of "actitivy", "time", or "extra_attributes" must be present in an Invalidation assertion.')
 
-        attributes = OrderedDict()
-        attributes[PROV_ATTR_ENTITY] = entity
-        attributes[PROV_ATTR_ACTIVITY] = activity
-        attributes[PROV_ATTR_TIME] = time
+        attributes = RecordAttributes(self._attribute_layout, [entity, activity, time])
         ProvRelation.add_attributes(self, attributes, extra_attributes)
 
 
 ### Component 2: Derivations
 
 class ProvDerivation(ProvRelation):
+    __slots__ = ()
+    _attribute_layout = AttributeLayout(PROV_ATTR_GENERATED_ENTITY, PROV_ATTR_USED_ENTITY, PROV_ATTR_ACTIVITY, PROV_ATTR_GENERATION, PROV_ATTR_USAGE)
+
     def get_type(self):
         return PROV_REC_DERIVATION
 
@@ -732,18 +1002,15 @@ class ProvDerivation(ProvRelation):
         generation = self.optional_attribute(attributes, PROV_ATTR_GENERATION, ProvGeneration)
         usage = self.optional_attribute(attributes, PROV_ATTR_USAGE, ProvUsage)
 
-        attributes = OrderedDict()
-        attributes[PROV_ATTR_GENERATED_ENTITY]= generatedEntity
-        attributes[PROV_ATTR_USED_ENTITY]= usedEntity
-        attributes[PROV_ATTR_ACTIVITY]= activity
-        attributes[PROV_ATTR_GENERATION] = generation
-        attributes[PROV_ATTR_USAGE] = usage
+        attributes = RecordAttributes(self._attribute_layout, [generatedEntity, usedEntity, activity, generation, usage])
         ProvRelation.add_attributes(self, attributes, extra_attributes)
 
 
 ### Component 3: Agents, Responsibility, and Influence
 
 class ProvAgent(ProvElement):
+    __slots__ = ()
+
     def get_type(self):
         return PROV_REC_AGENT
 
@@ -752,6 +1019,9 @@ class ProvAgent(ProvElement):
 
 
 class ProvAttribution(ProvRelation):
+    __slots__ = ()
+    _attribute_layout = AttributeLayout(PROV_ATTR_ENTITY, PROV_ATTR_AGENT)
+
     def get_type(self):
         return PROV_REC_ATTRIBUTION
 
@@ -763,12 +1033,13 @@ class ProvAttribution(ProvRelation):
         entity = self.required_attribute(attributes, PROV_ATTR_ENTITY, ProvEntity)
         agent = self.required_attribute(attributes, PROV_ATTR_AGENT, (ProvAgent, ProvEntity))
 
-        attributes = OrderedDict()
-        attributes[PROV_ATTR_ENTITY] = entity
-        attributes[PROV_ATTR_AGENT] = agent
+        attributes = RecordAttributes(self._attribute_layout, [entity, agent])
         ProvRelation.add_attributes(self, attributes, extra_attributes)
 
 class ProvAssociation(ProvRelation):
+    __slots__ = ()
+    _attribute_layout = AttributeLayout(PROV_ATTR_ACTIVITY, PROV_ATTR_AGENT, PROV_ATTR_PLAN)
+
     def get_type(self):
         return PROV_REC_ASSOCIATION
 
@@ -782,13 +1053,10 @@ class ProvAssociation(ProvRelation):
         agent = self.optional_attribute(attributes, PROV_ATTR_AGENT, (ProvAgent, ProvEntity))
         plan = self.optional_attribute(attributes, PROV_ATTR_PLAN, ProvEntity)
 
-        attributes = OrderedDict()
-        attributes[PROV_ATTR_ACTIVITY]= activity
-        attributes[PROV_ATTR_AGENT]= agent
-        attributes[PROV_ATTR_PLAN]= plan
+        attributes = RecordAttributes(self._attribute_layout, [activity, agent, plan])
         ProvRelation.add_attributes(self, attributes, extra_attributes)
 
-    def get_provn(self, _indent_level=0):
+    def _encode_provn(self):
         items = []
         if self._attributes:
             items.append(str(self._attributes[PROV_ATTR_ACTIVITY].get_identifier()))
@@ -809,6 +1077,9 @@ class ProvAssociation(ProvRelation):
 
 
 class ProvDelegation(ProvRelation):
+    __slots__ = ()
+    _attribute_layout = AttributeLayout(PROV_ATTR_DELEGATE, PROV_ATTR_RESPONSIBLE, PROV_ATTR_ACTIVITY)
+
     def get_type(self):
         return PROV_REC_DELEGATION
 
@@ -822,13 +1093,13 @@ class ProvDelegation(ProvRelation):
         # Optional attributes
         activity = self.optional_attribute(attributes, PROV_ATTR_ACTIVITY, ProvActivity)
 
-        attributes = OrderedDict()
-        attributes[PROV_ATTR_DELEGATE] = delegate
-        attributes[PROV_ATTR_RESPONSIBLE] = responsible
-        attributes[PROV_ATTR_ACTIVITY]= activity
+        attributes = RecordAttributes(self._attribute_layout, [delegate, responsible, activity])
         ProvRelation.add_attributes(self, attributes, extra_attributes)
 
 class ProvInfluence(ProvRelation):
+    __slots__ = ()
+    _attribute_layout = AttributeLayout(PROV_ATTR_INFLUENCEE, PROV_ATTR_INFLUENCER, PROV_ATTR_ACTIVITY)
+
     def get_type(self):
         return PROV_REC_INFLUENCE
 
@@ -842,10 +1113,7 @@ class ProvInfluence(ProvRelation):
         # Optional attributes
         activity = self.optional_attribute(attributes, PROV_ATTR_ACTIVITY, ProvActivity)
 
-        attributes = OrderedDict()
-        attributes[PROV_ATTR_INFLUENCEE] = influencee
-        attributes[PROV_ATTR_INFLUENCER] = influencer
-        attributes[PROV_ATTR_ACTIVITY]= activity
+        attributes = RecordAttributes(self._attribute_layout, [influencee, influencer, activity])
         ProvRelation.add_attributes(self, attributes, extra_attributes)
 
 
@@ -856,6 +1124,9 @@ class ProvInfluence(ProvRelation):
 ### Component 5: Alternate Entities
 
 class ProvSpecialization(ProvRelation):
+    __slots__ = ()
+    _attribute_layout = AttributeLayout(PROV_ATTR_SPECIFIC_ENTITY, PROV_ATTR_GENERAL_ENTITY)
+
     def get_type(self):
         return PROV_REC_SPECIALIZATION
 
@@ -867,13 +1138,14 @@ class ProvSpecialization(ProvRelation):
         specificEntity = self.required_attribute(attributes, PROV_ATTR_SPECIFIC_ENTITY, ProvEntity)
         generalEntity = self.required_attribute(attributes, PROV_ATTR_GENERAL_ENTITY, ProvEntity)
 
-        attributes = OrderedDict()
-        attributes[PROV_ATTR_SPECIFIC_ENTITY]= specificEntity
-        attributes[PROV_ATTR_GENERAL_ENTITY]= generalEntity
+        attributes = RecordAttributes(self._attribute_layout, [specificEntity, generalEntity])
         ProvRelation.add_attributes(self, attributes, extra_attributes)
 
 
 class ProvAlternate(ProvRelation):
+    __slots__ = ()
+    _attribute_layout = AttributeLayout(PROV_ATTR_ALTERNATE1, PROV_ATTR_ALTERNATE2)
+
     def get_type(self):
         return PROV_REC_ALTERNATE
 
@@ -885,12 +1157,13 @@ class ProvAlternate(ProvRelation):
         alternate1 = self.required_attribute(attributes, PROV_ATTR_ALTERNATE1, ProvEntity)
         alternate2 = self.required_attribute(attributes, PROV_ATTR_ALTERNATE2, ProvEntity)
 
-        attributes = OrderedDict()
-        attributes[PROV_ATTR_ALTERNATE1]= alternate1
-        attributes[PROV_ATTR_ALTERNATE2]= alternate2
+        attributes = RecordAttributes(self._attribute_layout, [alternate1, alternate2])
         ProvRelation.add_attributes(self, attributes, extra_attributes)
 
 class ProvMention(ProvSpecialization):
+    __slots__ = ()
+    _attribute_layout = AttributeLayout(PROV_ATTR_SPECIFIC_ENTITY, PROV_ATTR_GENERAL_ENTITY, PROV_ATTR_BUNDLE)
+
     def get_type(self):
         return PROV_REC_MENTION
 
@@ -910,16 +1183,16 @@ class ProvMention(ProvSpecialization):
         #    raise ProvExceptionContraint(PROV_REC_MENTION, generalEntity, bundle, 'The generalEntity must belong to the bundle')
         #=======================================================================
 
-        attributes = OrderedDict()
-        attributes[PROV_ATTR_SPECIFIC_ENTITY]= specificEntity
-        attributes[PROV_ATTR_GENERAL_ENTITY]= generalEntity
-        attributes[PROV_ATTR_BUNDLE]= bundle
+        attributes = RecordAttributes(self._attribute_layout, [specificEntity, generalEntity, bundle])
         ProvRelation.add_attributes(self, attributes, extra_attributes)
 
 
 ### Component 6: Collections
 
 class ProvMembership(ProvRelation):
+    __slots__ = ()
+    _attribute_layout = AttributeLayout(PROV_ATTR_COLLECTION, PROV_ATTR_ENTITY)
+
     def get_type(self):
         return PROV_REC_MEMBERSHIP
 
@@ -931,9 +1204,7 @@ class ProvMembership(ProvRelation):
         collection = self.required_attribute(attributes, PROV_ATTR_COLLECTION, ProvEntity)
         entity = self.required_attribute(attributes, PROV_ATTR_ENTITY, ProvEntity)
 
-        attributes = OrderedDict()
-        attributes[PROV_ATTR_COLLECTION]= collection
-        attributes[PROV_ATTR_ENTITY]= entity
+        attributes = RecordAttributes(self._attribute_layout, [collection, entity])
         ProvRelation.add_attributes(self, attributes, extra_attributes)
 
 # Class mappings from PROV record type
@@ -959,36 +1230,189 @@ PROV_REC_CLS = {
     }
 
 
+class _JSONStreamReader(object):
+    """Incremental reader of a JSON document from a file object.
+
+    Objects can be walked member by member with iter_members() while the
+    values themselves are decoded one at a time with read_value(), so only
+    the part of the document being decoded is held in memory.
+    """
+    def __init__(self, fileobj, chunk_size=65536):
+        self._file = fileobj
+        self._chunk_size = chunk_size
+        self._buffer = ''
+        self._pos = 0
+        self._decoder = json.JSONDecoder()
+
+    def _fill(self):
+        # Drop what has been consumed and read at least as much as is buffered,
+        # so re-decoding a value spanning several chunks stays linear
+        self._buffer = self._buffer[self._pos:]
+        self._pos = 0
+        chunk = self._file.read(max(self._chunk_size, len(self._buffer)))
+        self._buffer += chunk
+        return bool(chunk)
+
+    def _peek(self):
+        while True:
+            while self._pos < len(self._buffer):
+                if self._buffer[self._pos] not in ' \t\n\r':
+                    return self._buffer[self._pos]
+                self._pos += 1
+            if not self._fill():
+                return ''
+
+    def _expect(self, char):
+        if self._peek() != char:
+            raise ValueError('Expecting %r at position %d of the JSON stream' % (char, self._pos))
+        self._pos += 1
+
+    def read_value(self):
+        self._peek()
+        while True:
+            try:
+                value, self._pos = self._decoder.raw_decode(self._buffer, self._pos)
+                return value
+            except ValueError:
+                # The value may continue in the next chunk
+                if not self._fill():
+                    raise
+
+    def iter_members(self):
+        """Yields the keys of the object at the current position.
+
+        The value of each key must be consumed before the next key is requested.
+        """
+        self._expect('{')
+        if self._peek() == '}':
+            self._pos += 1
+            return
+        while True:
+            key = self.read_value()
+            self._expect(':')
+            yield key
+            if self._peek() == '}':
+                self._pos += 1
+                return
+            self._expect(',')
+
+
 # Bundle
 class NamespaceManager(dict):
+    """Map of prefix -> Namespace, indexed by namespace and by URI.
+
+    A URI is compacted into the QName of the namespace with the longest
+    matching URI by probing the URI index once for each distinct length of
+    the registered URIs, longest first, instead of scanning every namespace.
+    """
     def __init__(self, default_namespaces={}, default=None):
         self._default_namespaces = {}
         self._default_namespaces.update(default_namespaces)
         self._namespaces = {}
-        self.update(self._default_namespaces)
+        # indices of the namespaces in the map, see _set_namespace
+        self._registered = set()
+        self._uri_map = {}
+        self._uri_lengths = []
+        # memoized lookups, see get_attribute_identifier and get_datatype_decoder
+        self._attribute_ids = {}
+        self._datatype_decoders = {}
+        for prefix, namespace in self._default_namespaces.items():
+            self._set_namespace(prefix, namespace)
         self._default = default
         # TODO check if default is in the default namespaces
         self._anon_id_count = 0
         self._rename_map = {}
 
-    def get_namespace(self, uri):
+    def _set_namespace(self, prefix, namespace):
+        replaced = self.get(prefix)
+        self[prefix] = namespace
+        # names may resolve differently now
+        self._attribute_ids.clear()
+        self._datatype_decoders.clear()
+        if replaced is not None and not replaced == namespace:
+            # rare, e.g. a new default namespace
+            self._reindex()
+        else:
+            self._index_namespace(namespace)
+
+    def _index_namespace(self, namespace):
+        self._registered.add(namespace)
+        uri = namespace._uri
+        if uri not in self._uri_map:
+            # the first namespace registered for a URI is used for compaction
+            self._uri_map[uri] = namespace
+            length = len(uri)
+            position = bisect.bisect_left(self._uri_lengths, length)
+            if position == len(self._uri_lengths) or self._uri_lengths[position] <> length:
+                self._uri_lengths.insert(position, length)
+
+    def _reindex(self):
+        self._registered = set()
+        self._uri_map = {}
+        self._uri_lengths = []
         for namespace in self.values():
-            if uri == namespace._uri:
-                return namespace
+            self._index_namespace(namespace)
+
+    def _compact(self, uri):
+        """Returns the QName of uri in the namespace with the longest matching URI, or None."""
+        uri_map = self._uri_map
+        size = len(uri)
+        for length in reversed(self._uri_lengths):
+            if length <= size:
+                namespace = uri_map.get(uri[:length])
+                if namespace is not None:
+                    return namespace[uri[length:]]
         return None
 
+    def get_namespace(self, uri):
+        return self._uri_map.get(uri)
+
+    def __getstate__(self):
+        # the memoized lookups are rebuilt when needed
+        state = self.__dict__.copy()
+        state['_attribute_ids'] = {}
+        state['_datatype_decoders'] = {}
+        return state
+
+    def get_attribute_identifier(self, name):
+        """Returns the valid identifier of an attribute name, memoized as documents use few distinct names."""
+        try:
+            return self._attribute_ids[name]
+        except KeyError:
+            identifier = self._attribute_ids[name] = self.get_valid_identifier(name)
+            return identifier
+
+    def get_datatype_decoder(self, datatype):
+        """Returns the function decoding the values of a PROV-JSON typed literal datatype."""
+        try:
+            return self._datatype_decoders[datatype]
+        except KeyError:
+            # Check for common data types
+            # TODO Add a proper XSD datatype converter to replace this
+            if datatype == u'xsd:anyURI':
+                decoder = Identifier
+            elif datatype == u'xsd:QName':
+                decoder = self.get_valid_identifier
+            elif datatype == u'xsd:dateTime':
+                decoder = parse_xsd_dateTime
+            else:
+                datatype_id = self.get_attribute_identifier(datatype)
+                decoder = lambda value: Literal(value, datatype_id)
+            self._datatype_decoders[datatype] = decoder
+            return decoder
+
     def get_registered_namespaces(self):
         return self._namespaces.values()
 
     def set_default_namespace(self, uri):
         self._default = Namespace('', uri)
-        self[''] = self._default
+        self._set_namespace('', self._default)
 
     def get_default_namespace(self):
         return self._default
 
     def add_namespace(self, namespace):
-        if namespace in self.values():
+        if namespace in self._registered:
             # no need to do anything
             return
         if namespace in self._rename_map:
@@ -1004,7 +1428,18 @@ class NamespaceManager(dict):
             prefix = new_prefix
             namespace = new_namespace
         self._namespaces[prefix] = namespace
-        self[prefix] = namespace
+        self._set_namespace(prefix, namespace)
+
+    def rename_identifier(self, identifier):
+        """Returns identifier in the namespace it has been renamed to by add_namespace, if any."""
+        if isinstance(identifier, QName):
+            namespace = identifier.get_namespace()
+            if namespace not in self._registered:
+                self.add_namespace(namespace)
+                renamed = self._rename_map.get(namespace)
+                if renamed is not None:
+                    return renamed[identifier.get_localpart()]
+        return identifier
 
     def get_valid_identifier(self, identifier):
         if not identifier:
@@ -1013,7 +1448,7 @@ class NamespaceManager(dict):
             if isinstance(identifier, QName):
                 # Register the namespace if it has not been registered before
                 namespace = identifier.get_namespace()
-                if namespace not in self.values():
+                if namespace not in self._registered:
                     self.add_namespace(namespace)
                     # return the original identifier
             return identifier
@@ -1029,11 +1464,10 @@ class NamespaceManager(dict):
                 else:
                     # treat as a URI (with the first part as its scheme)
                     # check if the URI can be compacted
-                    for namespace in self.values():
-                        if identifier.startswith(namespace.get_uri()):
-                            # create a QName with the namespace
-                            return namespace[identifier.replace(namespace.get_uri(), '')]
-                            # return an Identifier with the given URI
+                    qname = self._compact(identifier)
+                    if qname is not None:
+                        return qname
+                    # return an Identifier with the given URI
                     return Identifier(identifier)
             elif self._default:
                 # create and return an identifier in the default namespace
@@ -1051,7 +1485,7 @@ class NamespaceManager(dict):
             return original_prefix
         count = 1
         while True:
-            new_prefix = '_'.join((original_prefix, count))
+            new_prefix = '_'.join((original_prefix, str(count)))
             if new_prefix in self:
                 count += 1
             else:
@@ -1059,11 +1493,22 @@ class NamespaceManager(dict):
 
 
 class ProvBundle(ProvEntity):
+    __slots__ = ('_records', '_id_map', '_bundles', '_namespaces', '_type_index', '_relations_from', '_relations_to',
+                 '_lineage')
+
     def __init__(self, bundle=None, identifier=None, attributes=None, other_attributes=None):
         # Initializing bundle-specific attributes
         self._records = list()
         self._id_map = dict()
         self._bundles = dict()
+        # record type -> records
+        self._type_index = dict()
+        # element -> relations with the element as their subject (first attribute)
+        self._relations_from = dict()
+        # element -> relations referring to the element in another attribute
+        self._relations_to = dict()
+        # the relations of the bundle tree by record key, see _get_lineage_adjacency
+        self._lineage = None
         if bundle is None:
             self._namespaces = NamespaceManager({ PROV.get_prefix(): PROV, XSD.get_prefix(): XSD})
         else:
@@ -1120,6 +1565,159 @@ class ProvBundle(ProvEntity):
             else:
                 return None
 
+    # Indexed queries
+    def get_records_by_type(self, *record_types):
+        """Returns the records of this bundle of the given types, e.g. PROV_REC_ENTITY."""
+        records = []
+        for record_type in record_types:
+            records.extend(self._type_index.get(record_type, ()))
+        return records
+
+    def get_elements(self):
+        """Returns the elements of this bundle, sub-bundles included, by record type."""
+        return self.get_records_by_type(*PROV_ELEMENT_TYPES)
+
+    def get_relations(self):
+        """Returns the relations of this bundle, by record type."""
+        return self.get_records_by_type(*PROV_RELATION_TYPES)
+
+    def get_relations_from(self, element, *record_types):
+        """Returns the relations of this bundle whose subject, their first attribute, is element.
+
+        element is a record or its identifier. Only the relations of the given
+        record types are returned if any, e.g. the generations of an entity
+        with get_relations_from(entity, PROV_REC_GENERATION) or the usages of
+        an activity with get_relations_from(activity, PROV_REC_USAGE).
+        """
+        return self._get_adjacent_relations(self._relations_from, element, record_types)
+
+    def get_relations_to(self, element, *record_types):
+        """Returns the relations of this bundle referring to element in another attribute than their subject.
+
+        element is a record or its identifier. Only the relations of the given
+        record types are returned if any, e.g. the usages of an entity with
+        get_relations_to(entity, PROV_REC_USAGE).
+        """
+        return self._get_adjacent_relations(self._relations_to, element, record_types)
+
+    def _get_adjacent_relations(self, adjacency, element, record_types):
+        if not isinstance(element, ProvRecord):
+            element = self.get_record(element) or self.get_bundle(element)
+        relations = adjacency.get(element, ())
+        if record_types:
+            return [relation for relation in relations if relation.get_type() in record_types]
+        return list(relations)
+
+    # Lineage
+    def ancestors(self, record, max_depth=None, relation_types=None):
+        """Yields the elements record depends on, nearest first.
+
+        record is an element or its identifier. The relations of this bundle
+        and of its sub-bundles are followed from their subject to the elements
+        it depends on (PROV_LINEAGE_ATTRIBUTES), e.g. from an entity to the
+        activity that generated it and from there to the entities it used.
+        Records with the same identifier in different bundles are the same
+        element. max_depth limits the number of relations followed and
+        relation_types the record types of the relations, all of them by
+        default. The traversal is breadth-first and lazy, every element is
+        yielded once.
+        """
+        return self._traverse_lineage(record, max_depth, relation_types, True)
+
+    def descendants(self, record, max_depth=None, relation_types=None):
+        """Yields the elements depending on record, nearest first.
+
+        The converse of ancestors, e.g. from an entity to the activities that
+        used it and the entities derived from it.
+        """
+        return self._traverse_lineage(record, max_depth, relation_types, False)
+
+    def _get_bundle_tree(self):
+        bundles = [self]
+        for bundle in bundles:
+            bundles.extend(bundle._type_index.get(PROV_REC_BUNDLE, ()))
+        return bundles
+
+    def _get_lineage_adjacency(self, upstream):
+        """Returns the relations of this bundle and its sub-bundles by the key of the records they refer to.
+
+        The key of a record is its identifier, so records with the same
+        identifier in different bundles share their relations. Values are
+        (record, relations) pairs. The adjacency is kept until a relation or
+        a sub-bundle is added to the bundle tree.
+        """
+        if self._lineage is None:
+            self._lineage = {}
+        adjacency = self._lineage.get(upstream)
+        if adjacency is None:
+            adjacency = self._lineage[upstream] = {}
+            for bundle in self._get_bundle_tree():
+                for current, relations in (bundle._relations_from if upstream else bundle._relations_to).iteritems():
+                    adjacency.setdefault(current._identifier or current, []).append((current, relations))
+        return adjacency
+
+    def _lineage_changed(self):
+        # the bundles containing this one include its relations in their adjacency
+        bundle = self
+        while bundle is not None:
+            bundle._lineage = None
+            bundle = bundle._bundle
+
+    def _traverse_lineage(self, record, max_depth, relation_types, upstream):
+        if isinstance(record, ProvRecord):
+            key = record._identifier or record
+        else:
+            key = self.valid_identifier(record)
+        if relation_types is None:
+            lineage = PROV_LINEAGE_ATTRIBUTES
+        else:
+            lineage = dict((rec_type, PROV_LINEAGE_ATTRIBUTES[rec_type]) for rec_type in relation_types)
+        adjacency = self._get_lineage_adjacency(upstream)
+
+        seen = set([key])
+        queue = collections.deque([(key, 0)])
+        while queue:
+            key, depth = queue.popleft()
+            if max_depth is not None and depth >= max_depth:
+                continue
+            for current, relations in adjacency.get(key, ()):
+                for relation in relations:
+                    attributes = lineage.get(relation.get_type())
+                    if attributes is None:
+                        continue
+                    subject_attr, object_attrs = attributes
+                    if upstream:
+                        nodes = [relation._attributes.get(attr) for attr in object_attrs]
+                    elif any(relation._attributes.get(attr) is current for attr in object_attrs):
+                        nodes = [relation._attributes.get(subject_attr)]
+                    else:
+                        continue
+                    for node in nodes:
+                        if isinstance(node, ProvRecord):
+                            node_key = node._identifier or node
+                            if node_key not in seen:
+                                seen.add(node_key)
+                                queue.append((node_key, depth + 1))
+                                yield node
+
+    def _index_relation(self, relation):
+        self._lineage_changed()
+        for position, value in enumerate(relation._attributes.values()):
+            if isinstance(value, ProvRecord):
+                adjacency = self._relations_from if position == 0 else self._relations_to
+                adjacency.setdefault(value, []).append(relation)
+
+    def _unindex_relation(self, relation):
+        self._lineage_changed()
+        for position, value in enumerate(relation._attributes.values()):
+            if isinstance(value, ProvRecord):
+                adjacency = self._relations_from if position == 0 else self._relations_to
+                relations = adjacency[value]
+                # by identity, equal relations may be asserted more than once
+                del relations[[id(item) for item in relations].index(id(relation))]
+                if not relations:
+                    del adjacency[value]
+
     # PROV-JSON serialization/deserialization
     class JSONEncoder(json.JSONEncoder):
         def default(self, o):
@@ -1131,11 +1729,38 @@ class ProvBundle(ProvEntity):
 
     class JSONDecoder(json.JSONDecoder):
         def decode(self, s):
-            json_container = json.JSONDecoder.decode(self, s)
+            if _json_backend is None:
+                json_container = json.JSONDecoder.decode(self, s)
+            else:
+                json_container = _json_backend.loads(s)
             result = ProvBundle()
             result._decode_JSON_container(json_container)
             return result
 
+    @classmethod
+    def load_stream(cls, fileobj):
+        """Decodes a PROV-JSON document from a file object incrementally.
+
+        Records are created as they are read, one at a time, instead of
+        decoding the whole document first, so the peak memory use is close to
+        that of the resulting bundle. Relations referring to records that have
+        not been read yet are held until those records are created. Records
+        appearing before the prefix section are held until it is read.
+        """
+        bundle = cls()
+        bundle._decode_JSON_stream(_JSONStreamReader(fileobj))
+        return bundle
+
+    def dump_stream(self, fileobj):
+        """Encodes the bundle in PROV-JSON to a file object incrementally.
+
+        The document is written record type section by section and record by
+        record, without building the JSON containers of the whole bundle
+        first. The output is the same as that of json.dump with
+        ProvBundle.JSONEncoder.
+        """
+        self._dump_JSON_stream(fileobj, json.JSONEncoder().encode)
+
     def _encode_json_representation(self, value):
         try:
             return value.json_representation()
@@ -1146,51 +1771,72 @@ class ProvBundle(ProvEntity):
                 return value
 
     def _decode_json_representation(self, value):
-        try:
-            # If the value is a string
-            # try matching a typed literal with uri pattern
+        # only strings of the form "value"^^datatype are typed literals,
+        # anything else is returned as it is
+        if not (isinstance(value, basestring) and value[:1] == u'"' and u'^^' in value):
+            return value
+        if value[-1:] == u'>':
+            # typed literal with uri pattern
             m = _r_typed_literal_uri.match(value)
-            if m is None:
-                # try matching a typed literal with qname pattern
-                m = _r_typed_literal_qname.match(value)
-            if m is not None:
-                # found one of the typed literal patterns
-                component = m.groupdict()
-                value_str = component['value']
-                datatype = component['datatype']
-                # Check for common data types
-                # TODO Add a proper XSD datatype converter to replace this
-                if datatype == u'xsd:anyURI':
-                    return Identifier(value_str)
-                elif datatype == u'xsd:QName':
-                    return self.valid_identifier(value_str)
-                elif datatype == u'xsd:dateTime':
-                    return parse_xsd_dateTime(value_str)
-                else:
-                    return Literal(value_str, self.valid_identifier(datatype))
-            else:
-                # cannot match the patterns, just return the string
-                return value
-        except:
-            # not a string, just return it
+        else:
+            # typed literal with qname pattern
+            m = _r_typed_literal_qname.match(value)
+        if m is None:
+            # cannot match the patterns, just return the string
             return value
+        value_str, datatype = m.group('value', 'datatype')
+        return self._namespaces.get_datatype_decoder(datatype)(value_str)
+
+    def _encode_JSON_prefixes(self):
+        prefixes = {}
+        for namespace in self._namespaces.get_registered_namespaces():
+            prefixes[namespace.get_prefix()] = namespace.get_uri()
+        if self._namespaces._default:
+            prefixes['$'] = self._namespaces._default.get_uri()
+        return prefixes
+
+    def _encode_JSON_ids(self):
+        ids = {}
+        # generating/mapping all record identifiers
+        for record in self._records:
+            ids[record] = record._identifier if record._identifier else self.get_anon_id(record)
+        return ids
+
+    def _encode_JSON_record(self, record, ids):
+        record_json = {}
+        if record._attributes:
+            for (attr, value) in record._attributes.items():
+                if isinstance(value, ProvRecord):
+                    attr_record_id = ids[value]
+                    record_json[PROV_ID_ATTRIBUTES_MAP[attr]] = str(attr_record_id)
+                elif value is not None:
+                    # Assuming this is a datetime value
+                    record_json[PROV_ID_ATTRIBUTES_MAP[attr]] = value.isoformat() if isinstance(value, datetime.datetime) else str(value)
+        if record._extra_attributes:
+            for (attr, value) in record._extra_attributes:
+                attr_id = str(attr)
+                value_json = self._encode_json_representation(value)
+                if attr_id in record_json:
+                    # Multi-value attribute
+                    existing_value = record_json[attr_id]
+                    if isinstance(existing_value, list):
+                        # Add the value to the current list of values
+                        existing_value.append(value_json)
+                    else:
+                        # create the list for the existing value and the second value
+                        record_json[attr_id] = [existing_value, value_json]
+                else:
+                    record_json[attr_id] = value_json
+        return record_json
 
     def _encode_JSON_container(self):
         container = defaultdict(dict)
 
         if self._bundle is None:
             # This is the top-level bundle, we need to define namespaces
-            prefixes = {}
-            for namespace in self._namespaces.get_registered_namespaces():
-                prefixes[namespace.get_prefix()] = namespace.get_uri()
-            if self._namespaces._default:
-                prefixes['$'] = self._namespaces._default.get_uri()
-            container[u'prefix'] = prefixes
+            container[u'prefix'] = self._encode_JSON_prefixes()
 
-        ids = {}
-        # generating/mapping all record identifiers
-        for record in self._records:
-            ids[record] = record._identifier if record._identifier else self.get_anon_id(record)
+        ids = self._encode_JSON_ids()
         for record in self._records:
             rec_type = record.get_type()
             rec_label = PROV_N_MAP[rec_type]
@@ -1200,43 +1846,70 @@ class ProvBundle(ProvEntity):
                 # encoding the sub-bundle
                 record_json = record._encode_JSON_container()
             else:
-                record_json = {}
-                if record._attributes:
-                    for (attr, value) in record._attributes.items():
-                        if isinstance(value, ProvRecord):
-                            attr_record_id = ids[value]
-                            record_json[PROV_ID_ATTRIBUTES_MAP[attr]] = str(attr_record_id)
-                        elif value is not None:
-                            # Assuming this is a datetime value
-                            record_json[PROV_ID_ATTRIBUTES_MAP[attr]] = value.isoformat() if isinstance(value, datetime.datetime) else str(value)
-                if record._extra_attributes:
-                    for (attr, value) in record._extra_attributes:
-                        attr_id = str(attr)
-                        value_json = self._encode_json_representation(value)
-                        if attr_id in record_json:
-                            # Multi-value attribute
-                            existing_value = record_json[attr_id]
-                            try:
-                                # Add the value to the current list of values
-                                existing_value.add(value_json)
-                            except:
-                                # But if the existing value is not a list, it'll fail
-                                # create the list for the existing value and the second value
-                                record_json[attr_id] = [existing_value, value_json]
-                        else:
-                            record_json[attr_id] = value_json
+                record_json = self._encode_JSON_record(record, ids)
             container[rec_label][identifier] = record_json
 
         return container
 
+    def _dump_JSON_stream(self, fileobj, encode):
+        # The sections hold the records, not their JSON, and are built in the
+        # same order as the container of _encode_JSON_container so that both
+        # write the sections and records in the same order
+        sections = defaultdict(dict)
+        if self._bundle is None:
+            sections[u'prefix'] = None
+        ids = self._encode_JSON_ids()
+        for record in self._records:
+            sections[PROV_N_MAP[record.get_type()]][str(ids[record])] = record
+
+        write = fileobj.write
+        write('{')
+        for section_count, (rec_label, records) in enumerate(sections.iteritems()):
+            if section_count:
+                write(', ')
+            write(encode(rec_label) + ': ')
+            if records is None:
+                write(encode(self._encode_JSON_prefixes()))
+                continue
+            write('{')
+            for record_count, (identifier, record) in enumerate(records.iteritems()):
+                if record_count:
+                    write(', ')
+                write(encode(identifier) + ': ')
+                if record.get_type() == PROV_REC_BUNDLE:
+                    record._dump_JSON_stream(fileobj, encode)
+                else:
+                    write(encode(self._encode_JSON_record(record, ids)))
+            write('}')
+        write('}')
+
+    def _decode_JSON_prefixes(self, prefixes):
+        for prefix, uri in prefixes.items():
+            if prefix <> '$':
+                self.add_namespace(Namespace(prefix, uri))
+            else:
+                self.set_default_namespace(uri)
+
+    def _decode_JSON_attributes(self, attributes, record_map):
+        prov_attributes = {}
+        extra_attributes = []
+        # Splitting PROV attributes and the others
+        for attr, value in attributes.items():
+            if attr in PROV_ATTRIBUTES_ID_MAP:
+                prov_attributes[PROV_ATTRIBUTES_ID_MAP[attr]] = record_map[value] if (isinstance(value, (str, unicode)) and value in record_map) else self._decode_json_representation(value)
+            else:
+                attr_id = self._namespaces.get_attribute_identifier(attr)
+                if isinstance(value, list):
+                    # Parsing multi-value attribute
+                    extra_attributes.append((attr_id, self._decode_json_representation(value_single)) for value_single in value)
+                else:
+                    # add the single-value attribute
+                    extra_attributes.append((attr_id, self._decode_json_representation(value)))
+        return prov_attributes, extra_attributes
+
     def _decode_JSON_container(self, jc):
         if u'prefix' in jc:
-            prefixes = jc[u'prefix']
-            for prefix, uri in prefixes.items():
-                if prefix <> '$':
-                    self.add_namespace(Namespace(prefix, uri))
-                else:
-                    self.set_default_namespace(uri)
+            self._decode_JSON_prefixes(jc[u'prefix'])
         records = sorted([(PROV_RECORD_IDS_MAP[rec_type], rec_id, jc[rec_type][rec_id])
         for rec_type in jc if rec_type <> u'prefix'
         for rec_id in jc[rec_type]],
@@ -1253,95 +1926,303 @@ class ProvBundle(ProvEntity):
         for (record_type, identifier, attributes) in records:
             if record_type <> PROV_REC_BUNDLE:
                 record = record_map[identifier]
-                prov_attributes = {}
-                extra_attributes = []
-                # Splitting PROV attributes and the others
-                for attr, value in attributes.items():
-                    if attr in PROV_ATTRIBUTES_ID_MAP:
-                        prov_attributes[PROV_ATTRIBUTES_ID_MAP[attr]] = record_map[value] if (isinstance(value, (str, unicode)) and value in record_map) else self._decode_json_representation(value)
-                    else:
-                        attr_id = self.valid_identifier(attr)
-                        if isinstance(value, list):
-                            # Parsing multi-value attribute
-                            extra_attributes.append((attr_id, self._decode_json_representation(value_single)) for value_single in value)
-                        else:
-                            # add the single-value attribute
-                            extra_attributes.append((attr_id, self._decode_json_representation(value)))
+                prov_attributes, extra_attributes = self._decode_JSON_attributes(attributes, record_map)
+                record.add_attributes(prov_attributes, extra_attributes)
+
+    def _decode_JSON_stream(self, reader):
+        # Records waiting for the identifiers they refer to, each entry is
+        # [number of missing references, record type, identifier, attributes]
+        pending = defaultdict(list)
+        waiting = []
+        # Records read before the namespaces are known
+        deferred = []
+        has_prefixes = False
+        # Records with anonymous identifiers, by the identifiers used in the document
+        anonymous = {}
+
+        def reference_key(value):
+            return value if value.startswith('_:') else self.valid_identifier(value)
+
+        def decode_record(record_type, identifier, content):
+            if record_type == PROV_REC_BUNDLE:
+                bundle = self.bundle(identifier)
+                bundle._decode_JSON_container(content)
+                return
+            missing = set()
+            for attr, value in content.items():
+                if attr in PROV_ATTRIBUTES_ID_MAP and PROV_ATTRIBUTES_ID_MAP[attr] not in PROV_ATTRIBUTE_LITERALS and isinstance(value, (str, unicode)):
+                    if value not in anonymous and self.get_record(value) is None and self.get_bundle(value) is None:
+                        missing.add(reference_key(value))
+            if missing:
+                entry = [len(missing), record_type, identifier, content]
+                for missing_id in missing:
+                    pending[missing_id].append(entry)
+                waiting.append(entry)
+            else:
+                add_record(record_type, identifier, content)
+
+        def add_record(record_type, identifier, content):
+            queue = [(record_type, identifier, content)]
+            while queue:
+                record_type, identifier, content = queue.pop()
+                record = self.add_record(record_type, identifier, None, None)
+                prov_attributes, extra_attributes = self._decode_JSON_attributes(content, anonymous)
                 record.add_attributes(prov_attributes, extra_attributes)
+                if record.get_identifier() is None:
+                    anonymous[identifier] = record
+                # release the records that were waiting for this one
+                for entry in pending.pop(reference_key(identifier), ()):
+                    entry[0] -= 1
+                    if entry[0] == 0:
+                        queue.append(entry[1:])
+                        entry[3] = None
+
+        for rec_type in reader.iter_members():
+            if rec_type == u'prefix':
+                self._decode_JSON_prefixes(reader.read_value())
+                has_prefixes = True
+                for record in deferred:
+                    decode_record(*record)
+                deferred = None
+            else:
+                record_type = PROV_RECORD_IDS_MAP[rec_type]
+                for identifier in reader.iter_members():
+                    record = (record_type, identifier, reader.read_value())
+                    if has_prefixes:
+                        decode_record(*record)
+                    else:
+                        deferred.append(record)
+        if not has_prefixes:
+            for record in deferred:
+                decode_record(*record)
+        # Records referring to identifiers missing from the document are added
+        # last and resolved as the non-incremental decoder would
+        for entry in waiting:
+            if entry[0] > 0:
+                entry[0] = 0
+                add_record(*entry[1:])
 
     # Miscellaneous functions
     def get_type(self):
         return PROV_REC_BUNDLE
 
     def get_provn(self, _indent_level=0):
+        return ''.join(self._iter_provn(_indent_level))
+
+    def write_provn(self, fileobj):
+        """Writes the PROV-N representation of the bundle to a file object.
+
+        The text is written record by record as it is generated, the same as
+        get_provn() but without holding the whole document in memory.
+        """
+        write = fileobj.write
+        for chunk in self._iter_provn():
+            write(chunk)
+
+    def _iter_provn(self, _indent_level=0):
         indentation = '' +  ('  ' * _indent_level)
         newline = '\n' + ('  ' * (_indent_level + 1))
         if self._bundle is None:
-            records = ['bundle']
+            yield 'bundle'
             # print out prefixes in the top-level bundle
-            records.extend(['prefix %s <%s>' % (namespace.get_prefix(), namespace.get_uri()) for namespace in self._namespaces.get_registered_namespaces()])
+            for namespace in self._namespaces.get_registered_namespaces():
+                yield newline + 'prefix %s <%s>' % (namespace.get_prefix(), namespace.get_uri())
             # a blank line between the prefixes and the assertions
-            records.append('')
+            yield newline
         else:
-            records = ['bundle %s' % self._identifier]
+            yield 'bundle %s' % self._identifier
 
-        records.extend([record.get_provn(_indent_level + 1) for record in self._records])
-        provn_str = newline.join(records) + '\n' +\
-                    indentation + 'endBundle'
-        return provn_str
+        for record in self._records:
+            yield newline
+            if isinstance(record, ProvBundle):
+                for chunk in record._iter_provn(_indent_level + 1):
+                    yield chunk
+            else:
+                yield record.get_provn(_indent_level + 1)
+        yield '\n' + indentation + 'endBundle'
+
+    def get_digest(self):
+        """Returns a SHA-1 hex digest of the bundle's identifier and records.
+
+        The records are represented by their digests, in no particular order,
+        so two bundles asserting the same records have the same digest. It is
+        kept until a record is added to the bundle or to one of its sub-bundles,
+        or one of their records changes.
+        """
+        if self._digest is None:
+            records = sorted(record.get_digest() for record in self._records)
+            items = [PROV_N_MAP[PROV_REC_BUNDLE], self._identifier.get_uri() if self._identifier else None, records]
+            self._digest = hashlib.sha1(json.dumps(items)).hexdigest()
+        return self._digest
 
     def __eq__(self, other):
-        try:
-            other_records = set(other._records)
-        except:
-            # other is not a bundle
+        """Bundles are equal if they assert the same records, whatever their order.
+
+        The records are compared as multisets of their digests.
+        """
+        if not isinstance(other, ProvBundle):
             return False
-        this_records = set(self._records)
-        if len(this_records) <> len(other_records):
+        if len(self._records) <> len(other._records):
+            return False
+        this_records = collections.Counter(record.get_digest() for record in self._records)
+        other_records = collections.Counter(record.get_digest() for record in other._records)
+        if this_records <> other_records:
+            logger.debug("%d PROV records differ" % sum(((this_records - other_records) + (other_records - this_records)).values()))
             return False
-            # check if all records for equality
-        for record_a in this_records:
-            if record_a._identifier:
-                if record_a.get_type() == PROV_REC_BUNDLE:
-                    record_b = other.get_bundle(record_a._identifier)
-                else:
-                    record_b = other.get_record(record_a._identifier)
-                if record_b:
-                    if record_a == record_b:
-                        other_records.remove(record_b)
-                        continue
-                    else:
-                        logger.debug("Inequal PROV records:")
-                        logger.debug("%s" % str(record_a))
-                        logger.debug("%s" % str(record_b))
-                        return False
-                else:
-                    logger.debug("Could not find a record with this identifier: %s" % str(record_a._identifier))
-                    return False
-            else:
-                # Manually look for the record
-                found = False
-                for record_b in other_records:
-                    if record_a == record_b:
-                        other_records.remove(record_b)
-                        found = True
-                        break
-                if not found:
-                    logger.debug("Could not find this record: %s" % str(record_a))
-                    return False
         return True
 
+    def __ne__(self, other):
+        return not self == other
+
     # Provenance statements
     def add_record(self, record_type, identifier, attributes=None, other_attributes=None):
         new_record = PROV_REC_CLS[record_type](self, self.valid_identifier(identifier), attributes, other_attributes)
+        self._register_record(new_record)
+        return new_record
+
+    def _register_record(self, new_record):
+        record_type = new_record.get_type()
         self._records.append(new_record)
+        self._type_index.setdefault(record_type, []).append(new_record)
+        if record_type == PROV_REC_BUNDLE:
+            self._lineage_changed()
+        if self._digest is not None:
+            new_record._changed()
         if new_record._identifier:
             if record_type == PROV_REC_BUNDLE:
                 # Don't mix bunle ids with normal record ids.
                 self._bundles[new_record._identifier] = new_record
             else:
                 self._id_map[new_record._identifier] = new_record
-        return new_record
+
+    # Merging
+    def merge(self, *bundles):
+        """Adds the records of the given bundles to this bundle and returns it.
+
+        The namespaces of each bundle are added once, a prefix bound to
+        another URI here is renamed by the namespace manager and the
+        identifiers in that namespace follow. A record whose identifier is
+        already in this bundle is not added again, the extra attributes it
+        does not have are added to the existing record instead. Records
+        without identifier are matched by digest to the records that were
+        here before their bundle was merged: identical records of a bundle
+        are distinct, the n-th of them is not added again if there are at
+        least n such records here. Sub-bundles are merged into the sub-bundles
+        with the same identifiers. The records are copied without validating
+        their attributes again, so merging takes time linear in the total
+        number of records.
+        """
+        namespaces = self._namespaces
+        # source record -> record of this bundle
+        mapping = {}
+        # id of a bundle -> {digest -> records without identifier}, built when
+        # first needed, and (id of a bundle, id of a source bundle) -> {digest ->
+        # records of the source matched so far}
+        anonymous = {}
+        for bundle in bundles:
+            if bundle is self:
+                continue
+            if bundle._namespaces is not namespaces:
+                default = bundle.get_default_namespace()
+                if default is not None:
+                    if namespaces.get_default_namespace() is None:
+                        namespaces.set_default_namespace(default.get_uri())
+                    namespaces.add_namespace(default)
+                for namespace in bundle.get_registered_namespaces():
+                    namespaces.add_namespace(namespace)
+            self._merge_records(bundle, mapping, anonymous)
+        return self
+
+    def _merge_records(self, source, mapping, anonymous):
+        mapping[source] = self
+        # elements first, the relations refer to them
+        for record in source.get_elements():
+            self._merge_record(record, mapping, anonymous)
+        for record in source.get_relations():
+            self._merge_record(record, mapping, anonymous)
+        for bundle in source.get_records_by_type(PROV_REC_BUNDLE):
+            mapping[bundle]._merge_records(bundle, mapping, anonymous)
+
+    def _merge_record(self, record, mapping, anonymous):
+        merged = mapping.get(record)
+        if merged is not None:
+            return merged
+        rename = self._namespaces.rename_identifier
+        identifier = rename(record._identifier)
+        if identifier:
+            if record.get_type() == PROV_REC_BUNDLE:
+                merged = self._bundles.get(identifier)
+            else:
+                merged = self._id_map.get(identifier)
+        else:
+            digests = anonymous.get(id(self))
+            if digests is None:
+                digests = anonymous[id(self)] = {}
+                for existing in self._records:
+                    if existing._identifier is None:
+                        digests.setdefault(existing.get_digest(), []).append(existing)
+            # the digests only depend on URIs, not on prefixes
+            digest = record.get_digest()
+            occurrences = anonymous.setdefault((id(self), id(record._bundle)), {})
+            occurrence = occurrences.get(digest, 0)
+            occurrences[digest] = occurrence + 1
+            # the records added from this bundle come after the ones that were here
+            candidates = digests.get(digest, ())
+            if occurrence < len(candidates):
+                merged = candidates[occurrence]
+        extra_attributes = None
+        if record._extra_attributes:
+            extra_attributes = [(rename(attr), self._merge_value(value, mapping, anonymous))
+                                for attr, value in record._extra_attributes]
+
+        if merged is not None:
+            mapping[record] = merged
+            if extra_attributes and extra_attributes != merged._extra_attributes:
+                present = set((attr, _digest_representation(value)) for attr, value in merged._extra_attributes or ())
+                added = [(attr, value) for attr, value in extra_attributes
+                         if (attr, _digest_representation(value)) not in present]
+                if added:
+                    if merged._extra_attributes is None:
+                        merged._extra_attributes = []
+                    merged._extra_attributes.extend(added)
+                    merged._changed()
+            return merged
+
+        merged = PROV_REC_CLS[record.get_type()](self, identifier)
+        mapping[record] = merged
+        if record._attributes:
+            merged._attributes = RecordAttributes(record._attribute_layout,
+                [self._merge_value(value, mapping, anonymous) for value in record._attributes.values()])
+        merged._extra_attributes = extra_attributes
+        self._register_record(merged)
+        if merged._attributes and merged.is_relation():
+            self._index_relation(merged)
+        if not identifier:
+            digests.setdefault(digest, []).append(merged)
+        return merged
+
+    def _merge_value(self, value, mapping, anonymous):
+        if isinstance(value, ProvRecord):
+            merged = mapping.get(value)
+            if merged is None:
+                if value._bundle is self:
+                    merged = value
+                elif value.is_relation() and value._bundle in mapping:
+                    # a relation referring to another one, merged first
+                    merged = mapping[value._bundle]._merge_record(value, mapping, anonymous)
+                else:
+                    # a record of a bundle that is not merged
+                    identifier = self._namespaces.rename_identifier(value._identifier)
+                    merged = (self.get_record(identifier) or self.get_bundle(identifier)) if identifier else None
+                    if merged is None:
+                        merged = value
+            return merged
+        elif isinstance(value, QName):
+            return self._namespaces.rename_identifier(value)
+        elif isinstance(value, Literal) and isinstance(value._datatype, QName):
+            datatype = self._namespaces.rename_identifier(value._datatype)
+            return value if datatype is value._datatype else Literal(value._value, datatype)
+        return value
 
     def add_element(self, record_type, identifier, attributes=None, other_attributes=None):
         return self.add_record(record_type, identifier, attributes, other_attributes)
@@ -49,27 +49,22 @@ def prov_to_dot(prov_g):
     count = [0, 0, 0]
 
     def _bundle_to_dot(dot, bundle):
-        records = bundle.get_records()
-        relations = []
-        for rec in records:
-            if rec.is_element():
-                if isinstance(rec, ProvBundle):
-                    count[2] = count[2] + 1
-                    subdot = pydot.Cluster(graph_name='c%d' % count[2])
-                    subdot.set_label('"%s"' % str(rec.get_identifier()))
-                    _bundle_to_dot(subdot, rec)
-                    dot.add_subgraph(subdot)
-                else:
-                    count[0] = count[0] + 1
-                    node_id = 'n%d' % count[0]
-                    node_label = '"%s"' % str(rec.get_identifier())
-                    style = DOT_PROV_STYLE[rec.get_type()]
-                    node = pydot.Node(node_id, label=node_label, **style)
-                    node_map[rec] = node
-                    dot.add_node(node)
+        for rec in bundle.get_elements():
+            if isinstance(rec, ProvBundle):
+                count[2] = count[2] + 1
+                subdot = pydot.Cluster(graph_name='c%d' % count[2])
+                subdot.set_label('"%s"' % str(rec.get_identifier()))
+                _bundle_to_dot(subdot, rec)
+                dot.add_subgraph(subdot)
             else:
-                relations.append(rec)
-        for rec in relations:
+                count[0] = count[0] + 1
+                node_id = 'n%d' % count[0]
+                node_label = '"%s"' % str(rec.get_identifier())
+                style = DOT_PROV_STYLE[rec.get_type()]
+                node = pydot.Node(node_id, label=node_label, **style)
+                node_map[rec] = node
+                dot.add_node(node)
+        for rec in bundle.get_relations():
             nodes = [node for node in rec._attributes.values() if node is not None and isinstance(node, ProvElement)]
             if len(nodes) < 2:
                 # Cannot draw this
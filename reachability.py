@@ -0,0 +1,285 @@
+"""
+Precomputed reachability of the elements of a finished PROV bundle
+
+Answers "does X depend on Y" (is Y an ancestor of X, see
+ProvBundle.ancestors) without walking the graph. The lineage graph is
+condensed into its strongly connected components, and every component is
+labelled with the intervals of the post-order numbers, in a spanning forest
+of the condensation, of the components it reaches. A query is a binary search
+in the intervals of one component. For the tree-like graphs of workflows a
+component has few intervals, far fewer than its ancestors.
+
+Example:
+
+>>> index = ReachabilityIndex.build(bundle)
+>>> index.depends_on('nipype:node_9_out_file', 'nipype:node_0_out_file')
+True
+>>> with open('workflow.reach', 'w') as f:
+...     index.save(f)
+>>> index = ReachabilityIndex.load(open('workflow.reach'))
+"""
+__author__ = 'nolan'
+
+import array
+import bisect
+import json
+
+import prov
+
+
+def _node_key(record):
+    # elements are the same node across bundles when they have the same identifier
+    identifier = record.get_identifier()
+    return identifier.get_uri() if identifier else record
+
+
+def _bundle_tree(bundle):
+    bundles = [bundle]
+    for bundle in bundles:
+        bundles.extend(bundle.get_records_by_type(prov.PROV_REC_BUNDLE))
+    return bundles
+
+
+def _lineage_graph(bundle, relation_types=None):
+    """
+    node keys and the successors of every node, from a node to the nodes it depends on
+    """
+    if relation_types is None:
+        lineage = prov.PROV_LINEAGE_ATTRIBUTES
+    else:
+        lineage = dict((rec_type, prov.PROV_LINEAGE_ATTRIBUTES[rec_type]) for rec_type in relation_types)
+    nodes = {}
+    successors = []
+
+    def node(record):
+        key = _node_key(record)
+        number = nodes.get(key)
+        if number is None:
+            number = nodes[key] = len(successors)
+            successors.append([])
+        return number
+
+    for current in _bundle_tree(bundle):
+        for element in current.get_elements():
+            node(element)
+        for relation in current.get_records_by_type(*lineage.keys()):
+            attributes = relation.get_attributes()[0]
+            if not attributes:
+                continue
+            subject_attr, object_attrs = lineage[relation.get_type()]
+            subject = attributes.get(subject_attr)
+            if not isinstance(subject, prov.ProvRecord):
+                continue
+            for attr in object_attrs:
+                value = attributes.get(attr)
+                if isinstance(value, prov.ProvRecord):
+                    successors[node(subject)].append(node(value))
+    return nodes, successors
+
+
+def _components(successors):
+    """
+    strongly connected components (Tarjan, iteratively), successors first
+
+    Returns the component of every node and the number of components.
+    """
+    count = len(successors)
+    index = [-1] * count
+    lowlink = [0] * count
+    component = [-1] * count
+    stack = []
+    next_index = 0
+    components = 0
+    for root in xrange(count):
+        if index[root] >= 0:
+            continue
+        work = [(root, 0)]
+        while work:
+            node, position = work.pop()
+            if position == 0:
+                index[node] = lowlink[node] = next_index
+                next_index += 1
+                stack.append(node)
+            elif position <= len(successors[node]):
+                # back from the previous successor
+                lowlink[node] = min(lowlink[node], lowlink[successors[node][position - 1]])
+            recursed = False
+            while position < len(successors[node]):
+                successor = successors[node][position]
+                position += 1
+                if index[successor] < 0:
+                    work.append((node, position))
+                    work.append((successor, 0))
+                    recursed = True
+                    break
+                elif component[successor] < 0:
+                    lowlink[node] = min(lowlink[node], index[successor])
+            if recursed:
+                continue
+            if lowlink[node] == index[node]:
+                while True:
+                    member = stack.pop()
+                    component[member] = components
+                    if member == node:
+                        break
+                components += 1
+    return component, components
+
+
+def _merge(intervals):
+    intervals.sort()
+    merged = [intervals[0]]
+    for start, end in intervals[1:]:
+        if start <= merged[-1][1] + 1:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+
+class ReachabilityIndex(object):
+    """
+    Reachability labels of the elements of a bundle, built with build() or read with load()
+
+    The index is a snapshot: records added to the bundle afterwards are not
+    in it. Elements are looked up by record, Identifier, URI or prefixed name
+    in one of the bundle's namespaces; elements without an identifier can only
+    be looked up by record, and not in a loaded index.
+    """
+    def __init__(self, nodes, post, offsets, starts, ends, prefixes):
+        # node key -> component
+        self._nodes = nodes
+        # component -> post-order number
+        self._post = post
+        # intervals of component c: starts/ends[offsets[c]:offsets[c + 1]]
+        self._offsets = offsets
+        self._starts = starts
+        self._ends = ends
+        self._prefixes = prefixes
+
+    @classmethod
+    def build(cls, bundle, relation_types=None):
+        """
+        index the lineage of a bundle and its sub-bundles, following relation_types, all by default
+        """
+        nodes, successors = _lineage_graph(bundle, relation_types)
+        component, count = _components(successors)
+
+        # the condensation, components are numbered successors first
+        dag = [set() for c in xrange(count)]
+        for node, targets in enumerate(successors):
+            source = component[node]
+            for target in targets:
+                if component[target] != source:
+                    dag[source].add(component[target])
+
+        # post-order numbers and subtree intervals in a spanning forest of the
+        # condensation, roots taken from the last components (the sources)
+        post = array.array('l', [-1]) * count
+        low = array.array('l', [0]) * count
+        number = 0
+        for root in xrange(count - 1, -1, -1):
+            if post[root] >= 0:
+                continue
+            post[root] = -2
+            work = [(root, iter(dag[root]), number)]
+            while work:
+                current, children, first = work[-1]
+                for child in children:
+                    if post[child] == -1:
+                        post[child] = -2
+                        work.append((child, iter(dag[child]), number))
+                        break
+                else:
+                    work.pop()
+                    post[current] = number
+                    low[current] = first
+                    number += 1
+
+        # every component reaches what its successors reach, which are
+        # labelled first as components are numbered successors first
+        offsets = array.array('l', [0]) * (count + 1)
+        starts = array.array('l')
+        ends = array.array('l')
+        for c in xrange(count):
+            intervals = [(low[c], post[c])]
+            for target in dag[c]:
+                intervals.extend(zip(starts[offsets[target]:offsets[target + 1]],
+                                     ends[offsets[target]:offsets[target + 1]]))
+            for start, end in _merge(intervals):
+                starts.append(start)
+                ends.append(end)
+            offsets[c + 1] = len(starts)
+
+        nodes = dict((key, component[node]) for key, node in nodes.iteritems())
+        prefixes = dict((namespace.get_prefix(), namespace.get_uri())
+                        for namespace in bundle.get_registered_namespaces())
+        default = bundle.get_default_namespace()
+        if default is not None:
+            prefixes[''] = default.get_uri()
+        return cls(nodes, post, offsets, starts, ends, prefixes)
+
+    def __len__(self):
+        return len(self._nodes)
+
+    def __contains__(self, element):
+        return self._component(element) is not None
+
+    def _key(self, element):
+        if isinstance(element, prov.ProvRecord):
+            return _node_key(element)
+        elif isinstance(element, prov.Identifier):
+            return element.get_uri()
+        elif element not in self._nodes:
+            if ':' in element:
+                prefix, local_part = element.split(':', 1)
+                if prefix in self._prefixes:
+                    return self._prefixes[prefix] + local_part
+            elif '' in self._prefixes:
+                return self._prefixes[''] + element
+        return element
+
+    def _component(self, element):
+        return self._nodes.get(self._key(element))
+
+    def depends_on(self, element, ancestor):
+        """
+        True if ancestor is one of the ancestors of element, in O(log n)
+
+        Like ProvBundle.ancestors, an element is not its own ancestor.
+        """
+        element, ancestor = self._key(element), self._key(ancestor)
+        source = self._nodes.get(element)
+        target = self._nodes.get(ancestor)
+        if source is None or target is None or element == ancestor:
+            return False
+        if source == target:
+            # elements of a cycle depend on each other
+            return True
+        number = self._post[target]
+        first, last = self._offsets[source], self._offsets[source + 1]
+        position = bisect.bisect_right(self._starts, number, first, last) - 1
+        return position >= first and self._ends[position] >= number
+
+    def save(self, fileobj):
+        """
+        write the index as JSON, to be read with load()
+        """
+        json.dump({
+            'nodes': dict((key, c) for key, c in self._nodes.iteritems() if isinstance(key, basestring)),
+            'post': self._post.tolist(),
+            'offsets': self._offsets.tolist(),
+            'starts': self._starts.tolist(),
+            'ends': self._ends.tolist(),
+            'prefixes': self._prefixes,
+        }, fileobj)
+
+    @classmethod
+    def load(cls, fileobj):
+        """
+        read an index written by save()
+        """
+        data = json.load(fileobj)
+        return cls(data['nodes'], array.array('l', data['post']), array.array('l', data['offsets']),
+                   array.array('l', data['starts']), array.array('l', data['ends']), data['prefixes'])
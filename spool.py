@@ -0,0 +1,253 @@
+"""
+Durable local spool for deferred graph ingest
+
+Bundles are appended to an on-disk log and ingested later by a background
+drainer, so that writing provenance does not wait on the graph database.
+"""
+__author__ = 'nolan'
+
+import json
+import logging
+import os
+import threading
+
+import prov
+
+logger = logging.getLogger(__name__)
+
+
+class Spool(object):
+    """
+    Append-only log of PROV-JSON bundles, one per line
+
+    The offset up to which the log has been ingested is kept next to it in
+    <path>.ack, so a restarted drainer resumes where the last one stopped.
+    Entries that cannot be ingested are moved to <path>.dead, one per line
+    like in the spool, from where they can be spooled again.
+
+    Example:
+
+    >>> spool = Spool("provenance.spool")
+    >>> offset = spool.append(bundle)
+    >>> for offset, bundle in spool.read(spool.acknowledged()):
+    ...     ingest(bundle)
+    ...     spool.acknowledge(offset)
+    """
+    def __init__(self, path):
+        self._path = path
+        self._ack_path = path + '.ack'
+        self._dead_path = path + '.dead'
+        self._lock = threading.Lock()
+        self._file = open(path, 'ab')
+        self._recover()
+
+    def _recover(self, block_size=65536):
+        """
+        drop a partially written entry left by a crash
+
+        Only the end of the log is read, back to its last newline.
+        """
+        with open(self._path, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            size = end = f.tell()
+            while end > 0:
+                start = max(0, end - block_size)
+                f.seek(start)
+                newline = f.read(end - start).rfind('\n')
+                if newline >= 0:
+                    end = start + newline + 1
+                    break
+                end = start
+        if end < size:
+            self._file.truncate(end)
+
+    def close(self):
+        self._file.close()
+
+    def append(self, bundle):
+        """
+        durably append a bundle, returns the offset at which its entry ends
+        """
+        line = json.dumps(bundle, cls=prov.ProvBundle.JSONEncoder) + '\n'
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            return self._file.tell()
+
+    def read(self, offset, max_entries=None):
+        """
+        return up to max_entries (end offset, bundle) pairs starting at offset
+        """
+        return [(offset, json.loads(line, cls=prov.ProvBundle.JSONDecoder))
+                for offset, line in self.read_lines(offset, max_entries)]
+
+    def read_lines(self, offset, max_entries=None):
+        """
+        return up to max_entries (end offset, line) pairs starting at offset, without decoding them
+        """
+        entries = []
+        with open(self._path, 'rb') as f:
+            f.seek(offset)
+            for line in iter(f.readline, ''):
+                if not line.endswith('\n'):
+                    # still being written
+                    break
+                offset += len(line)
+                entries.append((offset, line))
+                if max_entries and len(entries) >= max_entries:
+                    break
+        return entries
+
+    def dead_letter(self, line):
+        """
+        durably append an entry that cannot be ingested to <path>.dead
+        """
+        with self._lock:
+            with open(self._dead_path, 'ab') as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+
+    def acknowledged(self):
+        """
+        offset up to which the spool has been ingested
+        """
+        try:
+            with open(self._ack_path) as f:
+                return int(f.read() or 0)
+        except IOError:
+            return 0
+
+    def acknowledge(self, offset):
+        tmp_path = self._ack_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(str(offset))
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(tmp_path, self._ack_path)
+
+
+class SpoolDrainer(threading.Thread):
+    """
+    Background thread replaying a spool to the graph
+
+    Up to max_entries bundles are uploaded at a time as one batched, synced
+    upload. Entries are only acknowledged once uploaded, and the sync upload
+    makes replaying an entry after a failure or a crash harmless.
+
+    When an upload fails the entries are uploaded one by one, so that one
+    failing entry does not hold back the others. An entry is dead-lettered,
+    see Spool.dead_letter, when it cannot be decoded or when it has failed
+    max_attempts times while other entries could be uploaded. When no entry
+    can be uploaded the graph is taken to be unavailable and the entries
+    are retried later without counting the attempt.
+    """
+    def __init__(self, interface, spool, batch_size=500, max_entries=100, interval=1.0, max_attempts=5):
+        super(SpoolDrainer, self).__init__()
+        self.daemon = True
+        self._interface = interface
+        self._spool = spool
+        self._batch_size = batch_size
+        self._max_entries = max_entries
+        self._interval = interval
+        self._max_attempts = max_attempts
+        # end offset of an entry -> failed uploads, while the graph was available
+        self._attempts = {}
+        # end offsets of the dead-lettered entries not acknowledged yet
+        self._dead = set()
+        self._stopped = threading.Event()
+
+    def _upload(self, bundles):
+        self._interface.process_bundles(bundles, batch_size=self._batch_size, sync=True)
+
+    def drain(self):
+        """
+        upload the pending entries once, returns the number of entries ingested
+        """
+        count = 0
+        while True:
+            lines = self._spool.read_lines(self._spool.acknowledged(), self._max_entries)
+            if not lines:
+                return count
+            entries = []
+            # end offset -> True once uploaded, False once dead-lettered
+            done = {}
+            for offset, line in lines:
+                try:
+                    entries.append((offset, json.loads(line, cls=prov.ProvBundle.JSONDecoder)))
+                except Exception:
+                    if offset not in self._dead:
+                        logger.exception('Dead-lettering an entry of spool %s that cannot be decoded',
+                                         self._spool._path)
+                    self._dead_letter(offset, line, done)
+            unavailable = None
+            try:
+                if entries:
+                    self._upload([bundle for offset, bundle in entries])
+                done.update((offset, True) for offset, bundle in entries)
+            except Exception, e:
+                unavailable = e
+                if len(entries) > 1:
+                    logger.warning('Failed to upload %d entries of spool %s, uploading them one by one',
+                                   len(entries), self._spool._path)
+                    failed = []
+                    for offset, bundle in entries:
+                        try:
+                            self._upload([bundle])
+                            done[offset] = True
+                        except Exception, e:
+                            failed.append(offset)
+                    if len(failed) < len(entries):
+                        # the graph is available, the failed entries are at fault
+                        unavailable = None
+                        self._failed(failed, lines, done, e)
+
+            # acknowledge the entries done, up to the first one to retry
+            acknowledged = None
+            for offset, line in lines:
+                if offset not in done:
+                    break
+                acknowledged = offset
+                count += done[offset]
+                self._attempts.pop(offset, None)
+                self._dead.discard(offset)
+            if acknowledged is not None:
+                self._spool.acknowledge(acknowledged)
+            if unavailable is not None:
+                # retry the same entries later
+                raise unavailable
+            if acknowledged != lines[-1][0]:
+                return count
+
+    def _failed(self, failed, lines, done, error):
+        """
+        count a failed upload of the entries ending at the failed offsets, dead-lettering the ones out of attempts
+        """
+        lines = dict(lines)
+        for offset in failed:
+            attempts = self._attempts[offset] = self._attempts.get(offset, 0) + 1
+            if attempts >= self._max_attempts:
+                logger.error('Dead-lettering an entry of spool %s after %d failed uploads: %s',
+                             self._spool._path, attempts, error)
+                self._dead_letter(offset, lines[offset], done)
+
+    def _dead_letter(self, offset, line, done):
+        # an entry stays in the spool until acknowledged, it is only dead-lettered once
+        if offset not in self._dead:
+            self._spool.dead_letter(line)
+            self._dead.add(offset)
+        done[offset] = False
+
+    def run(self):
+        while not self._stopped.is_set():
+            try:
+                self.drain()
+            except Exception:
+                # the graph is unavailable, retry the same entries later
+                logger.exception('Failed to drain spool %s', self._spool._path)
+            self._stopped.wait(self._interval)
+
+    def stop(self, timeout=None):
+        self._stopped.set()
+        self.join(timeout)
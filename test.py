@@ -1,14 +1,20 @@
 __author__ = 'nolan'
 
-from bulbs.rexster import Graph, Config
+import json
+import StringIO
 
+import columnar
 from interface import Interface, Config
+from memory import MemoryGraph, Store
+import prov
+from reachability import ReachabilityIndex
 
 # configure for rexster database
-config = Config('http://50.112.248.236:8182/graphs/xcede-dm')
+#config = Config('http://<your-rexster-host>:8182/graphs/xcede-dm')
+#interface = Interface(config)
 
-# initialize the interface and establish proxy classes
-interface = Interface(config)
+# or run against an in-process graph
+interface = Interface(Store(), graph_class=MemoryGraph)
 
 # parse an example provenance.json file
 bundle = interface.parse_prov('workflow_provenance.json')
@@ -32,6 +38,124 @@ identifier='http://nipy.org/nipype/terms/0.6/ag1'
 for i in interface.agents.index.lookup(identifier=identifier):
     print i
 
+# identical unnamed relations are distinct records, every upload mode keeps both
+nipype = prov.Namespace('nipype', 'http://nipy.org/nipype/terms/0.6/')
+bundle = prov.ProvBundle()
+bundle.add_namespace(nipype)
+activity = bundle.activity(nipype['bet'])
+entity = bundle.entity(nipype['in_file'])
+bundle.used(activity, entity)
+bundle.used(activity, entity)
+for options in ({}, {'batch_size': 500}, {'workers': 2}):
+    store = Store()
+    response = Interface(store, graph_class=MemoryGraph).process_bundle(bundle, **options)
+    assert len(response) == 4 and len(store.elements('used')) == 2
+    # a sync run finds both edges and uploads nothing
+    response = Interface(store, graph_class=MemoryGraph).process_bundle(bundle, sync=True)
+    assert len(set(response.values())) == 4 and len(store.elements('used')) == 2
 
+# records repeated across bundles, e.g. a bundle spooled twice, are uploaded once
+text = json.dumps(bundle, cls=prov.ProvBundle.JSONEncoder)
+copies = [json.loads(text, cls=prov.ProvBundle.JSONDecoder) for i in range(2)]
+store = Store()
+response = Interface(store, graph_class=MemoryGraph).process_bundles(copies, sync=True)
+assert len(response) == 4 and len(store) == 4
+response = Interface(store, graph_class=MemoryGraph).process_bundles(copies, sync=True, batch_size=500)
+assert len(set(response.values())) == 4 and len(store) == 4
 
+# every relation type can be ingested, e.g. an influence
+bundle = prov.ProvBundle()
+bundle.add_namespace(nipype)
+influencer, influencee = bundle.entity(nipype['in_file']), bundle.entity(nipype['out_file'])
+bundle.add_record(prov.PROV_REC_INFLUENCE, None, {prov.PROV_ATTR_INFLUENCEE: influencee,
+                                                  prov.PROV_ATTR_INFLUENCER: influencer})
+text = json.dumps(bundle, cls=prov.ProvBundle.JSONEncoder)
+assert json.loads(text, cls=prov.ProvBundle.JSONDecoder).get_provn() == bundle.get_provn()
+for options in ({}, {'batch_size': 500}):
+    store = Store()
+    interface = Interface(store, graph_class=MemoryGraph)
+    interface.process_bundle(bundle, **options)
+    assert not interface.errors and len(store.elements('wasInfluencedBy')) == 1
 
+# relations missing an endpoint are reported in interface.errors, also from nested bundles
+bundle = prov.ProvBundle()
+bundle.add_namespace(nipype)
+workflow = bundle.bundle(nipype['workflow'])
+workflow.wasGeneratedBy(workflow.entity(nipype['out_file']), None)
+for options in ({}, {'batch_size': 500}, {'workers': 2}):
+    interface = Interface(Store(), graph_class=MemoryGraph)
+    interface.process_bundle(bundle, **options)
+    assert len(interface.errors) == 1
+
+# a bundle built through the API equals its PROV-JSON round trip
+bundle = interface.parse_prov('workflow_provenance.json')
+bundle.entity(nipype['no_attributes'])
+bundle.add_record(prov.PROV_REC_ACTIVITY, nipype['no_times'])
+copy = json.loads(json.dumps(bundle, cls=prov.ProvBundle.JSONEncoder), cls=prov.ProvBundle.JSONDecoder)
+assert copy == bundle and copy.get_digest() == bundle.get_digest()
+
+# the columnar store gives back an equal bundle
+store = columnar.ColumnarBundle.from_bundle(bundle)
+assert store.to_bundle() == bundle and store.to_bundle().get_digest() == bundle.get_digest()
+
+# merging keeps identical unnamed relations apart and adds nothing when merged again
+bundle = prov.ProvBundle()
+bundle.add_namespace(nipype)
+activity = bundle.activity(nipype['bet'])
+entity = bundle.entity(nipype['in_file'])
+bundle.used(activity, entity)
+bundle.used(activity, entity)
+merged = prov.ProvBundle().merge(bundle)
+assert len(merged.get_records()) == 4 and merged == bundle
+copy = json.loads(json.dumps(bundle, cls=prov.ProvBundle.JSONEncoder), cls=prov.ProvBundle.JSONDecoder)
+assert merged.merge(bundle, copy) == bundle
+
+# a prefix bound to another URI is renamed, the identifiers in its namespace follow
+other = prov.Namespace('nipype', 'http://example.org/other/')
+conflicting = prov.ProvBundle()
+conflicting.add_namespace(other)
+conflicting.entity(other['in_file'])
+merged.merge(conflicting)
+assert len(merged.get_elements()) == 3
+assert merged.get_record(other['in_file']).get_identifier().get_uri() == 'http://example.org/other/in_file'
+assert merged.get_record(nipype['in_file']) is not merged.get_record(other['in_file'])
+
+# the streaming encoder and decoder agree with json.dumps and json.loads
+bundle = interface.parse_prov('workflow_provenance.json')
+workflow = bundle.bundle(nipype['workflow'])
+workflow.wasDerivedFrom(workflow.entity(nipype['out_file']), workflow.entity(nipype['in_file']))
+stream = StringIO.StringIO()
+bundle.dump_stream(stream)
+text = json.dumps(bundle, cls=prov.ProvBundle.JSONEncoder)
+assert json.loads(stream.getvalue(), cls=prov.ProvBundle.JSONDecoder) == bundle
+assert prov.ProvBundle.load_stream(StringIO.StringIO(text)) == json.loads(text, cls=prov.ProvBundle.JSONDecoder) == bundle
+
+# the reachability index agrees with ancestors and descendants, also once saved and loaded
+bundle = prov.ProvBundle()
+bundle.add_namespace(nipype)
+files = [bundle.entity(nipype['file_%d' % i]) for i in range(6)]
+bet = bundle.activity(nipype['bet'])
+bundle.used(bet, files[0])
+bundle.wasGeneratedBy(files[1], bet)
+bundle.wasDerivedFrom(files[2], files[1])
+# a cycle
+bundle.wasDerivedFrom(files[3], files[2])
+bundle.wasDerivedFrom(files[2], files[3])
+# continued in a nested bundle, through an element with the same identifier
+workflow = bundle.bundle(nipype['workflow'])
+workflow.wasDerivedFrom(workflow.entity(nipype['file_4']), workflow.entity(nipype['file_3']))
+index = ReachabilityIndex.build(bundle)
+stream = StringIO.StringIO()
+index.save(stream)
+loaded = ReachabilityIndex.load(StringIO.StringIO(stream.getvalue()))
+elements = files + [bet]
+for element in elements:
+    ancestors = set(ancestor.get_identifier() for ancestor in bundle.ancestors(element))
+    descendants = set(descendant.get_identifier() for descendant in bundle.descendants(element))
+    for other in elements:
+        depends_on = other.get_identifier() in ancestors
+        assert index.depends_on(element, other) == depends_on
+        assert loaded.depends_on(str(element.get_identifier()), str(other.get_identifier())) == depends_on
+        assert index.depends_on(other, element) == (other.get_identifier() in descendants)
+assert index.depends_on(files[4], files[0]) and index.depends_on(files[2], files[3])
+assert not index.depends_on(files[0], files[4]) and not index.depends_on(files[5], files[0])